@@ -0,0 +1,142 @@
+import os
+import random
+import re
+from array import array
+
+# ===============================
+# KDEF Stimulus Catalog
+# ===============================
+# KDEF file names encode the photo session, sex, identity, emotion and viewing
+# angle, e.g. AM30HAS.JPG = session A, male, identity 30, happy, straight.
+# The catalog parses every name once into compact columns (one small integer
+# per image per field) and builds lookup tables by emotion, sex and identity,
+# so the experiments can draw stratified samples in constant time and copy an
+# image's attributes into the trial record without touching strings.
+
+SESSIONS = ("A", "B")
+SEXES = ("F", "M")
+EMOTION_CODES = {
+    "afraid": "AF",
+    "angry": "AN",
+    "disgusted": "DI",
+    "happy": "HA",
+    "neutral": "NE",
+    "sad": "SA",
+    "surprised": "SU"
+}
+EMOTIONS = tuple(EMOTION_CODES)
+ANGLES = ("S", "HL", "HR", "FL", "FR")
+
+# Attributes copied into trial records (see describe())
+ATTRIBUTES = ("id", "session", "sex", "identity", "angle")
+
+# Preprocessed faces keep the KDEF name as a prefix (AF01HAS-<hash>.bmp)
+KDEF_NAME = re.compile(r"([AB])([FM])(\d\d)(AF|AN|DI|HA|NE|SA|SU)(S|HL|HR|FL|FR)", re.IGNORECASE)
+
+
+# Identifier of a stimulus image, as recorded in the results files: the KDEF
+# name for faces ("AF01HAS"), folder and file name for everything else
+# ("circle/12")
+def item_id(path):
+    filename = os.path.basename(path)
+    match = KDEF_NAME.match(filename)
+    if match:
+        return match.group(0).upper()
+    return f"{os.path.basename(os.path.dirname(path))}/{os.path.splitext(filename)[0]}"
+
+
+class StimulusCatalog:
+    def __init__(self):
+        self.paths = []
+        self.ids = []                 # KDEF name without extension, e.g. "AM30HAS"
+        self.identities = []          # Identity names, e.g. "M30" (the same person in both sessions)
+        self.session = array("B")
+        self.sex = array("B")
+        self.identity = array("H")    # Index into self.identities
+        self.emotion = array("B")     # Index into EMOTIONS
+        self.angle = array("B")
+        self.by_emotion = {}          # emotion -> [row]
+        self.by_emotion_sex = {}      # (emotion, sex) -> [row]
+        self.by_identity = {}         # identity -> {emotion: [row]}
+        self._identity_index = {}
+        self._identity_sets = {}
+
+    # Build a catalog from {emotion: folder}; path_map swaps in preprocessed files
+    @classmethod
+    def from_folders(cls, folders, path_map=None):
+        catalog = cls()
+        for emotion, folder in folders.items():
+            for img_file in sorted(os.listdir(folder)):
+                if not img_file.lower().endswith((".jpg", ".jpeg", ".png")):
+                    continue
+                path = os.path.join(folder, img_file)
+                catalog.add(path_map.get(path, path) if path_map else path, img_file, emotion)
+        if not catalog.paths:
+            raise ValueError(f"No KDEF images found in: {', '.join(folders.values())}")
+        return catalog
+
+    def add(self, path, filename, emotion):
+        match = KDEF_NAME.match(filename)
+        if not match:
+            raise ValueError(f"Not a KDEF file name: {filename}")
+        session, sex, number, emotion_code, angle = (field.upper() for field in match.groups())
+        if EMOTION_CODES[emotion] != emotion_code:
+            raise ValueError(f"{path} is in the {emotion} set but its name says {emotion_code}")
+
+        identity_name = f"{sex}{number}"
+        if identity_name not in self._identity_index:
+            self._identity_index[identity_name] = len(self.identities)
+            self.identities.append(identity_name)
+
+        row = len(self.paths)
+        self.paths.append(path)
+        self.ids.append(match.group(0).upper())
+        self.session.append(SESSIONS.index(session))
+        self.sex.append(SEXES.index(sex))
+        self.identity.append(self._identity_index[identity_name])
+        self.emotion.append(EMOTIONS.index(emotion))
+        self.angle.append(ANGLES.index(angle))
+
+        self.by_emotion.setdefault(emotion, []).append(row)
+        self.by_emotion_sex.setdefault((emotion, sex), []).append(row)
+        self.by_identity.setdefault(identity_name, {}).setdefault(emotion, []).append(row)
+        self._identity_sets.clear()
+        return row
+
+    def __len__(self):
+        return len(self.paths)
+
+    # Random row with the given emotion (and sex, if given)
+    def sample(self, emotion, sex=None, rng=random):
+        rows = self.by_emotion[emotion] if sex is None else self.by_emotion_sex[(emotion, sex)]
+        return rows[rng.randrange(len(rows))]
+
+    # n rows of one emotion with as equal a number of women and men as possible
+    def sample_balanced(self, emotion, n, rng=random):
+        rows = [self.sample(emotion, SEXES[i % 2], rng) for i in range(n)]
+        rng.shuffle(rows)
+        return rows
+
+    # One identity shown with each of the given emotions, as {emotion: row}
+    def sample_identity_set(self, emotions, rng=random):
+        key = tuple(emotions)
+        if key not in self._identity_sets:
+            self._identity_sets[key] = [
+                identity for identity, rows in self.by_identity.items() if all(e in rows for e in emotions)
+            ]
+        candidates = self._identity_sets[key]
+        if not candidates:
+            raise ValueError(f"No identity has all of: {', '.join(emotions)}")
+        rows = self.by_identity[candidates[rng.randrange(len(candidates))]]
+        return {emotion: rows[emotion][rng.randrange(len(rows[emotion]))] for emotion in emotions}
+
+    # Path and attributes of a row for a trial record, with keys prefixed
+    def describe(self, row, prefix):
+        return {
+            f"{prefix}_path": self.paths[row],
+            f"{prefix}_id": self.ids[row],
+            f"{prefix}_session": SESSIONS[self.session[row]],
+            f"{prefix}_sex": SEXES[self.sex[row]],
+            f"{prefix}_identity": self.identities[self.identity[row]],
+            f"{prefix}_angle": ANGLES[self.angle[row]],
+        }
@@ -0,0 +1,279 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import cg
+
+import data_quality
+import image_stats
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Folder holding the results CSV files
+RESULTS_FOLDER = "."
+
+# Random factors per experiment (columns of the results files), crossed with
+# each other. Files recorded before the item columns existed are skipped.
+RANDOM_FACTORS = {
+    "exp_1": ["participant", "face_id"],
+    "exp_2": ["participant", "distractor_id", "shape_id"],
+}
+
+# Image statistics of the face shown on each trial (from image_stats.py's
+# index) entered as standardized fixed-effect covariates; [] to leave them out
+STIMULUS_COVARIATES = ["mean_luminance", "rms_contrast"]
+STIMULUS_INDEX = image_stats.INDEX_FILE
+
+# Column naming the face shown on each trial
+FACE_COLUMNS = {"exp_1": "face_id", "exp_2": "distractor_id"}
+
+# Leave out trials flagged by data_quality.py
+DROP_FLAGGED_TRIALS = True
+
+# Conjugate gradient tolerance for the mixed model equations
+SOLVER_TOLERANCE = 1e-8
+
+# ===============================
+# Crossed Random Effects Code
+# ===============================
+# Model, for RT (correct trials) and accuracy (linear probability model):
+#   y = X b + Z_1 u_1 + ... + Z_K u_K + e
+# X holds an intercept, the condition contrasts and the face's image
+# statistics (when stimulus_stats.csv exists), and Z_k the one-hot
+# columns of random factor k (participant, face, shape). Every Z_k is a
+# scipy.sparse matrix with one non-zero per trial, so memory grows with the
+# number of trials, never with participants x items.
+#
+# Variance components are estimated with the method of moments for crossed
+# designs (Gao & Owen, 2017). For each factor, the spread of the residuals
+# (of an ordinary least squares fit of X) within its levels is compared with
+# what each variance component predicts. The predictions only need level
+# counts and the sums of squared co-occurrence counts Z_k' Z_m. The
+# estimates then fix the shrinkage of the Henderson mixed model equations.
+# Those are sparse, and conjugate gradients solves them for the fixed effects
+# (with standard errors) and the random effects (BLUPs) of every participant
+# and item.
+#
+# Usage:
+#   python crossed_effects.py
+#   python crossed_effects.py --experiment exp_2 --item-effects exp2_items.csv
+
+
+# Sparse one-hot matrix (trials x levels) and the level names of a column
+def one_hot(column):
+    codes, levels = pd.factorize(column, sort=True)
+    rows = np.arange(len(codes))
+    matrix = sparse.csr_matrix((np.ones(len(codes)), (rows, codes)), shape=(len(codes), len(levels)))
+    return matrix, levels
+
+
+# Intercept plus treatment contrasts of the condition column (first level is the reference)
+def fixed_design(conditions):
+    levels = sorted(conditions.unique())
+    columns = [np.ones(len(conditions))] + [(conditions == level).to_numpy(float) for level in levels[1:]]
+    names = ["intercept"] + [f"{level} - {levels[0]}" for level in levels[1:]]
+    return np.column_stack(columns), names
+
+
+# Method-of-moments variance components for residuals r and random factor
+# matrices Z; returns [sigma2_1, ..., sigma2_K, sigma2_residual], or None when
+# the moment equations cannot tell the components apart
+def moment_variances(r, factor_matrices):
+    n = len(r)
+    k = len(factor_matrices)
+    counts = [np.asarray(z.sum(axis=0)).ravel() for z in factor_matrices]
+    system = np.zeros((k + 1, k + 1))
+    observed = np.zeros(k + 1)
+
+    for i, z in enumerate(factor_matrices):
+        # Sum over levels of n_level * within-level sum of squares
+        level_means = (z.T @ r) / np.maximum(counts[i], 1)
+        within = np.bincount(z.indices, weights=(r - level_means[z.indices]) ** 2, minlength=len(counts[i]))
+        observed[i] = (counts[i] * within).sum()
+        pairs = (counts[i] ** 2).sum()
+        for m, z_other in enumerate(factor_matrices):
+            if m != i:
+                system[i, m] = pairs - (((z.T @ z_other).data) ** 2).sum()
+        system[i, k] = pairs - n
+
+    observed[k] = n * ((r - r.mean()) ** 2).sum()
+    for m in range(k):
+        system[k, m] = n ** 2 - (counts[m] ** 2).sum()
+    system[k, k] = n ** 2 - n
+
+    if np.linalg.matrix_rank(system) < k + 1:
+        return None
+    return np.maximum(np.linalg.lstsq(system, observed, rcond=None)[0], 0.0)
+
+
+# Fit one crossed random effects model. Returns the fixed effects table, the
+# variance components and the random effects of every level of every factor,
+# or None when the data cannot separate the variance components (e.g. every
+# item was seen once, which leaves no residual variance).
+def fit(y, x, fixed_names, factors):
+    factor_matrices = []
+    level_names = []
+    for name, column in factors.items():
+        matrix, levels = one_hot(column)
+        factor_matrices.append(matrix)
+        level_names.append((name, levels))
+
+    ols = np.linalg.lstsq(x, y, rcond=None)[0]
+    variances = moment_variances(y - x @ ols, factor_matrices)
+    if variances is None or variances[-1] <= 0:
+        return None
+    residual_variance = variances[-1]
+
+    # Henderson's mixed model equations, [X Z]'[X Z] + diag(0, residual / sigma2_k)
+    z = sparse.hstack(factor_matrices, format="csr")
+    floor = 1e-12 * max(residual_variance, 1e-12)   # A zero component shrinks its effects to zero
+    shrinkage = np.concatenate([
+        np.full(matrix.shape[1], residual_variance / max(variance, floor))
+        for matrix, variance in zip(factor_matrices, variances[:-1])
+    ])
+    design = sparse.hstack([sparse.csr_matrix(x), z], format="csr")
+    penalty = sparse.diags(np.concatenate([np.zeros(x.shape[1]), shrinkage]))
+    system = (design.T @ design + penalty).tocsr()
+    preconditioner = sparse.diags(1.0 / system.diagonal())
+
+    def solve(rhs):
+        solution, info = cg(system, rhs, rtol=SOLVER_TOLERANCE, maxiter=10 * system.shape[0], M=preconditioner)
+        if info != 0:
+            print(f"  WARNING: solver did not converge ({info})")
+        return solution
+
+    solution = solve(design.T @ y)
+    p = x.shape[1]
+    standard_errors = []
+    for j in range(p):
+        unit = np.zeros(system.shape[0])
+        unit[j] = 1.0
+        standard_errors.append(np.sqrt(residual_variance * solve(unit)[j]))
+    if not np.all(np.isfinite(standard_errors)):
+        return None
+
+    fixed = pd.DataFrame({"term": fixed_names, "estimate": solution[:p], "se": standard_errors})
+    fixed["t"] = fixed["estimate"] / fixed["se"]
+    components = pd.DataFrame({
+        "component": [name for name, _ in level_names] + ["residual"],
+        "variance": variances,
+    })
+    components["share"] = components["variance"] / components["variance"].sum()
+
+    effects = []
+    offset = p
+    for (name, levels), matrix in zip(level_names, factor_matrices):
+        count = np.asarray(matrix.sum(axis=0)).ravel().astype(int)
+        effects.append(pd.DataFrame({
+            "factor": name, "level": levels, "trials": count, "effect": solution[offset:offset + len(levels)],
+        }))
+        offset += len(levels)
+    return fixed, components, pd.concat(effects, ignore_index=True)
+
+
+# Trials of one experiment ready for fitting (all participants in one table)
+def prepare(results, experiment):
+    trials = data_quality.normalize(results, experiment)
+    keep = trials["rt"].notna()
+    if DROP_FLAGGED_TRIALS:
+        keep &= ~data_quality.add_flags(results, experiment)["flagged"]
+    factors = RANDOM_FACTORS[experiment]
+    for factor in factors:
+        keep &= results[factor].fillna("") != ""   # Files from before items were recorded
+    return results[keep], trials[keep], factors
+
+
+# Standardized image statistics of each trial's face, or None without an
+# index. Trials whose face is not in the index get NaN.
+def stimulus_covariates(results, experiment):
+    if not STIMULUS_COVARIATES or not os.path.exists(STIMULUS_INDEX):
+        return None
+    face_column = FACE_COLUMNS[experiment]
+    rows = image_stats.join_stats(
+        results[[face_column]].to_dict("records"), face_column, "face", image_stats.load_index(STIMULUS_INDEX)
+    )
+    return pd.DataFrame(rows, index=results.index)[[f"face_{name}" for name in STIMULUS_COVARIATES]]
+
+
+def analyze(results, experiment):
+    results, trials, factors = prepare(results, experiment)
+    covariates = stimulus_covariates(results, experiment)
+    if covariates is not None:
+        known = covariates.notna().all(axis=1)
+        if not known.all():
+            print(f"{experiment}: {int((~known).sum())} trials show faces missing from {STIMULUS_INDEX}, left out")
+            results, trials, covariates = results[known], trials[known], covariates[known]
+        covariates = covariates.loc[:, covariates.std() > 0]   # A constant column is not identified
+        covariates = (covariates - covariates.mean()) / covariates.std()
+    if results.empty:
+        print(f"{experiment}: no usable trials")
+        return None
+    conditions = results[data_quality.CONDITION_COLUMNS[experiment]]
+    x, fixed_names = fixed_design(conditions)
+    if covariates is not None:
+        x = np.column_stack([x, covariates.to_numpy()])
+        fixed_names += [f"{column} (per SD)" for column in covariates.columns]
+    print(f"{experiment}: {len(results)} trials, "
+          + ", ".join(f"{results[factor].nunique()} {factor}" for factor in factors))
+
+    tables = []
+    correct = trials["correct"].to_numpy()
+    models = {
+        "rt": (trials["rt"].to_numpy()[correct], x[correct], results[correct]),
+        "accuracy": (correct.astype(float), x, results),
+    }
+    for measure, (y, design, rows) in models.items():
+        if len(y) == 0 or np.ptp(y) == 0:
+            print(f"\n{experiment} {measure}: no variation to model, skipped")
+            continue
+        fitted = fit(y, design, fixed_names, {factor: rows[factor] for factor in factors})
+        if fitted is None:
+            print(f"\n{experiment} {measure}: variance components not identified "
+                  f"(too few participants or items seen more than once), skipped")
+            continue
+        fixed, components, effects = fitted
+        print(f"\n{experiment} {measure}: fixed effects")
+        print(fixed.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+        print(f"{experiment} {measure}: variance components")
+        print(components.to_string(index=False, float_format=lambda value: f"{value:.6f}"))
+        effects.insert(0, "measure", measure)
+        tables.append(effects)
+    if not tables:
+        return None
+    item_effects = pd.concat(tables, ignore_index=True)
+    item_effects.insert(0, "experiment", experiment)
+    return item_effects
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit participant x item crossed random effects models.")
+    parser.add_argument("--results", default=RESULTS_FOLDER, help="Folder with the results CSV files")
+    parser.add_argument("--experiment", nargs="+", choices=list(RANDOM_FACTORS), default=list(RANDOM_FACTORS))
+    parser.add_argument("--item-effects", default="item_effects.csv", help="CSV for the participant and item effects")
+    args = parser.parse_args()
+
+    tables = []
+    for experiment in args.experiment:
+        results = data_quality.load_results(args.results, experiment)
+        missing = [factor for factor in RANDOM_FACTORS[experiment] if factor not in results.columns]
+        if results.empty:
+            print(f"{experiment}: no results files")
+            continue
+        if missing:
+            print(f"{experiment}: results files have no {', '.join(missing)} column (recorded before items were)")
+            continue
+        item_effects = analyze(results, experiment)
+        if item_effects is not None:
+            tables.append(item_effects)
+        print()
+    if tables:
+        pd.concat(tables, ignore_index=True).to_csv(args.item_effects, index=False)
+        print(f"Participant and item effects saved to {args.item_effects}")
+
+
+if __name__ == "__main__":
+    main()
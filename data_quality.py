@@ -0,0 +1,188 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Folder holding the <name>_<number>_exp1_results.csv / _exp2_results.csv files
+RESULTS_FOLDER = "."
+
+# Reaction times below this (seconds) are anticipations, not responses to the stimulus
+ANTICIPATORY_RT = 0.100
+
+# Key mashing: a trial is flagged when at least MASH_MIN_FAST of the
+# MASH_WINDOW trials centred on it were answered faster than MASH_RT
+MASH_WINDOW = 5
+MASH_MIN_FAST = 3
+MASH_RT = 0.250
+
+# Runs of the same response key at least this long are flagged
+SAME_KEY_RUN = 8
+
+# Runs of missed trials at least this long are flagged (exp_2 only, see below)
+NO_RESPONSE_RUN = 3
+
+# Participant exclusion criteria
+MAX_FLAGGED_FRACTION = 0.25   # Exclude when more of their trials than this are flagged
+MIN_ACCURACY = 0.50           # Exclude when accuracy on unflagged trials is lower
+
+# ===============================
+# Data Quality Code
+# ===============================
+# Reads every results file of both experiments into one table per
+# experiment and computes trial-level flags for the whole lab at once with
+# column operations (run lengths via shift/cumsum, centred rolling windows)
+# grouped by participant and session:
+#   anticipatory        reaction time below ANTICIPATORY_RT
+#   unmapped_key        a key was pressed that is not a response key. exp_1
+#                       leaves user_emotion empty; exp_2 writes "No Response"
+#                       to the response column but still records the RT.
+#   no_response         no key within the response window (exp_2 only:
+#                       exp_1 does not write trials without a keypress)
+#   no_response_streak  part of a run of at least NO_RESPONSE_RUN misses
+#   same_key_run        part of a run of at least SAME_KEY_RUN identical responses
+#   key_mashing         see MASH_WINDOW above
+#   flagged             any of the above
+# The flags are added as columns (qa_exp1_trials.csv, qa_exp2_trials.csv)
+# and summarized per participant with an exclusion decision (qa_summary.csv).
+#
+# Usage:
+#   python data_quality.py
+#   python data_quality.py --results data/ --output-dir qa/
+
+FLAGS = ["anticipatory", "unmapped_key", "no_response", "no_response_streak", "same_key_run", "key_mashing"]
+
+SUFFIXES = {"exp_1": "_exp1_results.csv", "exp_2": "_exp2_results.csv"}
+
+# Column holding each trial's condition
+CONDITION_COLUMNS = {"exp_1": "emotion", "exp_2": "distractor_type"}
+
+
+# One results file as a table, with participant ("<name>_<number>") and
+# trial (position in the file) columns
+def read_results_file(filename, experiment):
+    suffix = SUFFIXES[experiment]
+    frame = pd.read_csv(filename, dtype=str, keep_default_na=False)
+    frame.insert(0, "participant", os.path.basename(filename)[:-len(suffix)])
+    frame.insert(1, "trial", np.arange(len(frame)))
+    return frame
+
+
+# All results files of one experiment as one table, in recorded order
+def load_results(folder, experiment):
+    frames = [
+        read_results_file(filename, experiment)
+        for filename in sorted(glob.glob(os.path.join(folder, f"*{SUFFIXES[experiment]}")))
+    ]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+# Response key (condition name or None), reaction time and correctness in the
+# same form for both experiments
+def normalize(results, experiment):
+    rt = pd.to_numeric(results["reaction_time"], errors="coerce")
+    if experiment == "exp_1":
+        key = results["user_emotion"].where(results["user_emotion"] != "", None)
+        correct = results["response_type"] == "Correct"
+    else:
+        key = results["response"].where(results["response"] != "No Response", None)
+        correct = results["correctness"] == "Correct"
+    return pd.DataFrame({"key": key, "rt": rt, "correct": correct}, index=results.index)
+
+
+# Length of the run of equal values each row belongs to, within groups
+def run_lengths(values, groups):
+    run_id = (values != values.groupby(groups).shift()).cumsum()
+    return values.groupby([*groups, run_id]).transform("size")
+
+
+# Flag columns for every trial, aligned with the results table
+def add_flags(results, experiment):
+    trials = normalize(results, experiment)
+    groups = [results["participant"], results["session_number"]]
+    responded = trials["rt"].notna()
+
+    flags = pd.DataFrame(index=results.index)
+    flags["anticipatory"] = trials["rt"] < ANTICIPATORY_RT
+    flags["unmapped_key"] = responded & trials["key"].isna()
+    flags["no_response"] = ~responded
+    miss_runs = run_lengths(flags["no_response"], groups)
+    flags["no_response_streak"] = flags["no_response"] & (miss_runs >= NO_RESPONSE_RUN)
+
+    # Missing keys get a placeholder so that a run of misses is not a run of one key
+    keys = trials["key"].fillna("")
+    flags["same_key_run"] = (keys != "") & (run_lengths(keys, groups) >= SAME_KEY_RUN)
+
+    fast = (trials["rt"] < MASH_RT).astype(int)
+    fast_nearby = (
+        fast.groupby(groups).rolling(MASH_WINDOW, center=True, min_periods=1).sum()
+        .reset_index(level=[0, 1], drop=True)
+    )
+    flags["key_mashing"] = fast.astype(bool) & (fast_nearby >= MASH_MIN_FAST)
+
+    flags["flagged"] = flags[FLAGS].any(axis=1)
+    return flags
+
+
+# One row per participant: flag counts and the exclusion decision
+def summarize(results, flags, experiment):
+    correct = normalize(results, experiment)["correct"]
+    flags = flags.assign(participant=results["participant"], clean_correct=correct & ~flags["flagged"])
+    summary = flags.groupby("participant").agg(
+        trials=("flagged", "size"),
+        **{flag: (flag, "sum") for flag in FLAGS},
+        flagged=("flagged", "sum"),
+        clean_correct=("clean_correct", "sum"),
+    )
+    clean_trials = summary["trials"] - summary["flagged"]
+    summary["flagged_fraction"] = summary["flagged"] / summary["trials"]
+    summary["clean_accuracy"] = summary["clean_correct"] / clean_trials.where(clean_trials > 0)
+    summary = summary.drop(columns="clean_correct")
+
+    too_many_flags = summary["flagged_fraction"] > MAX_FLAGGED_FRACTION
+    low_accuracy = ~(summary["clean_accuracy"] >= MIN_ACCURACY)
+    summary["exclude"] = too_many_flags | low_accuracy
+    summary["reason"] = np.select(
+        [too_many_flags & low_accuracy, too_many_flags, low_accuracy],
+        ["flagged trials; accuracy", "flagged trials", "accuracy"],
+        default="",
+    )
+    summary.insert(0, "experiment", experiment)
+    return summary.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag contaminated trials and participants in all results files.")
+    parser.add_argument("--results", default=RESULTS_FOLDER, help="Folder with the results CSV files")
+    parser.add_argument("--output-dir", default=".", help="Where the flagged tables and the summary are written")
+    args = parser.parse_args()
+
+    summaries = []
+    for experiment, suffix in SUFFIXES.items():
+        results = load_results(args.results, experiment)
+        if results.empty:
+            print(f"{experiment}: no results files")
+            continue
+        flags = add_flags(results, experiment)
+        output = os.path.join(args.output_dir, f"qa{suffix.replace('_results', '_trials')}")
+        pd.concat([results, flags], axis=1).to_csv(output, index=False)
+        summary = summarize(results, flags, experiment)
+        summaries.append(summary)
+        print(f"{experiment}: {len(summary)} participants, {int(flags['flagged'].sum())} of {len(flags)} trials "
+              f"flagged, {int(summary['exclude'].sum())} participants excluded -> {output}")
+
+    if summaries:
+        output = os.path.join(args.output_dir, "qa_summary.csv")
+        pd.concat(summaries, ignore_index=True).to_csv(output, index=False, float_format="%.4f")
+        print(f"Summary saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import math
+
+from running_stats import RunningStats
+
+# ===============================
+# Sequential Early Stopping
+# ===============================
+# After every trial the per-condition accuracy and reaction time estimates
+# are updated in constant time (reaction times with Welford's algorithm, see
+# running_stats.py). A condition is "settled" once it has at least
+# min_trials trials and the 95% confidence interval half-widths of its mean
+# reaction time and its accuracy are at or below the configured precision.
+# The block can stop when every condition is settled. Only the condition of
+# the current trial is re-checked, so add() costs the same at trial 10 and
+# trial 1000 and fits easily into the feedback interval.
+
+Z_95 = 1.959964
+
+
+class ConditionEstimate:
+    def __init__(self):
+        self.trials = 0
+        self.correct = 0
+        self.rt = RunningStats()
+
+    def add(self, correct, reaction_time):
+        self.trials += 1
+        self.correct += bool(correct)
+        if reaction_time is not None:
+            self.rt.add(reaction_time)
+
+    # Half-width of the confidence interval for the mean reaction time
+    def rt_half_width(self):
+        if self.rt.n < 2:
+            return math.inf
+        return Z_95 * self.rt.sd / math.sqrt(self.rt.n)
+
+    # Half-width of the Agresti-Coull interval for accuracy (stays above zero
+    # at 0% and 100% correct, unlike the plain normal approximation)
+    def accuracy_half_width(self):
+        n = self.trials + Z_95 ** 2
+        p = (self.correct + Z_95 ** 2 / 2) / n
+        return Z_95 * math.sqrt(p * (1 - p) / n)
+
+
+class StoppingRule:
+    def __init__(self, conditions, min_trials, rt_precision, accuracy_precision):
+        self.min_trials = min_trials
+        self.rt_precision = rt_precision
+        self.accuracy_precision = accuracy_precision
+        self.estimates = {condition: ConditionEstimate() for condition in conditions}
+        self.unsettled = set(self.estimates)
+
+    def settled(self, estimate):
+        return (estimate.trials >= self.min_trials
+                and estimate.rt_half_width() <= self.rt_precision
+                and estimate.accuracy_half_width() <= self.accuracy_precision)
+
+    # Record one trial; returns True once the block can stop
+    def add(self, condition, correct, reaction_time):
+        estimate = self.estimates[condition]
+        estimate.add(correct, reaction_time)
+        if self.settled(estimate):
+            self.unsettled.discard(condition)
+        else:
+            self.unsettled.add(condition)
+        return not self.unsettled
@@ -1,8 +1,19 @@
 import pygame
-import os
-import random
 import csv
-import time
+import functools
+import random
+
+import catalog
+import early_stopping
+import image_cache
+import journal
+import markers
+import monitor
+import preflight
+import preprocess_faces
+import render_backend
+import schedules
+import timing
 
 # ===============================
 # Customizable Variables
@@ -11,6 +22,7 @@ import time
 # Window settings
 WINDOW_WIDTH = 1200
 WINDOW_HEIGHT = 800
+RENDER_BACKEND = "surface"    # "surface" or "texture" (SDL2 renderer, see render_backend.py)
 
 # Time settings (in seconds)
 FIXATION_TIME = 0.5           # Duration of fixation cross
@@ -24,6 +36,25 @@ BREAK_TEXT = "Take a short break! Press SPACE to continue."
 # Trial settings
 TOTAL_TRIALS = 200            # Total number of trials in the experiment
 
+# Early stopping: end the block once the 95% confidence intervals of every
+# condition are narrow enough (TOTAL_TRIALS remains the maximum)
+EARLY_STOPPING = False
+MIN_TRIALS_PER_CONDITION = 20 # Never stop before each condition has this many trials
+RT_PRECISION = 0.05           # Largest allowed half-width for mean reaction time (seconds)
+ACCURACY_PRECISION = 0.10     # Largest allowed half-width for accuracy (proportion)
+
+# Frame timing: a trial whose stimulus flip missed its refresh (landed more
+# than half a frame, or FRAME_TOLERANCE without vsync, off the configured
+# fixation time) is thrown out and repeated later with a new face of the same
+# emotion
+FRAME_CHECK = True
+FRAME_TOLERANCE = 0.017       # Seconds, used when flips are not vsync'd
+MAX_REQUEUES = 50             # Most trials repeated per session; one more late trial stops the block
+
+# Station check before the participant form (see preflight.py): "warn" prints
+# what cannot keep the timing budget, "refuse" does not start, None skips it
+PREFLIGHT = "warn"
+
 # Instructions
 INSTRUCTIONS = ("Press J for Happy, K for Neutral, L for Angry.\n"
                 "Press SPACE to start.")
@@ -35,6 +66,16 @@ STIMULI_PATHS = {
     "angry": "distractors/angry"
 }
 
+# Load faces preprocessed by preprocess_faces.py (cropped and resampled) when available
+USE_PREPROCESSED_FACES = True
+
+# Live monitoring: per-trial events are sent here for monitor.py (None to disable)
+MONITOR_ADDRESS = ("127.0.0.1", 47001)
+
+# Event markers: trigger codes sent right after each stimulus flip, for
+# co-registration with physiological recordings (None to disable; see markers.py)
+MARKER_ADDRESS = None
+
 # Key mappings
 key_mapping = {"happy": pygame.K_j, "neutral": pygame.K_k, "angry": pygame.K_l}
 
@@ -42,16 +83,49 @@ key_mapping = {"happy": pygame.K_j, "neutral": pygame.K_k, "angry": pygame.K_l}
 # Experiment Code
 # ===============================
 
-pygame.init()
+screen = None
+font = None
 
-# Screen settings
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption("Emotion Categorization Experiment")
-font = pygame.font.Font(None, 50)
+# Replays turn this off: their schedule already holds the repeated late trials
+requeue_late_trials = True
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
+# Attributes of the face image recorded with every trial
+FACE_FIELDS = [f"face_{attribute}" for attribute in catalog.ATTRIBUTES]
+
+
+# Open the experiment window (only the display and font modules are initialized)
+def init_display():
+    global screen, font
+    pygame.display.init()
+    pygame.font.init()
+    screen = render_backend.open_window(
+        (WINDOW_WIDTH, WINDOW_HEIGHT), "Emotion Categorization Experiment", RENDER_BACKEND
+    )
+    font = render_backend.CachedFont(None, 50)
+
+
+# Function to draw the participant info input form
+def draw_participant_form(instructions, participant_name, participant_number):
+    screen.fill(WHITE)
+
+    for i, text in enumerate(instructions):
+        text_surface = font.render(text, True, BLACK)
+        text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 100 + i * 100))
+        screen.blit(text_surface, text_rect)
+
+    name_surface = font.render(f"Name: {participant_name}", True, BLACK)
+    name_rect = name_surface.get_rect(center=(WINDOW_WIDTH // 2, 400))
+    screen.blit(name_surface, name_rect)
+
+    number_surface = font.render(f"Number: {participant_number}", True, BLACK)
+    number_rect = number_surface.get_rect(center=(WINDOW_WIDTH // 2, 500))
+    screen.blit(number_surface, number_rect)
+
+    timing.flip("participant_form")
+
 
 # Function to display participant info input form
 def get_participant_info():
@@ -64,31 +138,23 @@ def get_participant_info():
         "Enter Participant Number:",
         "Press ENTER to start the experiment."
     ]
+    needs_redraw = True
 
     while True:
-        screen.fill(WHITE)
-
-        for i, text in enumerate(instructions):
-            text_surface = font.render(text, True, BLACK)
-            text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 100 + i * 100))
-            screen.blit(text_surface, text_rect)
-
-        name_surface = font.render(f"Name: {participant_name}", True, BLACK)
-        name_rect = name_surface.get_rect(center=(WINDOW_WIDTH // 2, 400))
-        screen.blit(name_surface, name_rect)
+        # Redraw only when the form has changed
+        if needs_redraw:
+            draw_participant_form(instructions, participant_name, participant_number)
+            needs_redraw = False
 
-        number_surface = font.render(f"Number: {participant_number}", True, BLACK)
-        number_rect = number_surface.get_rect(center=(WINDOW_WIDTH // 2, 500))
-        screen.blit(number_surface, number_rect)
-
-        pygame.display.flip()
-
-        for event in pygame.event.get():
+        for event in timing.wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 return None, None
 
-            if event.type == pygame.KEYDOWN:
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                needs_redraw = True
+            elif event.type == pygame.KEYDOWN:
+                needs_redraw = True
                 if active_field == "name":
                     if event.key == pygame.K_RETURN:
                         active_field = "number"
@@ -105,159 +171,288 @@ def get_participant_info():
                         participant_number += event.unicode
 
 
+# Function to display experiment instructions
+def display_instructions():
+    screen.fill(WHITE)
+    lines = INSTRUCTIONS.split("\n")
+    for i, line in enumerate(lines):
+        text_surface = font.render(line, True, BLACK)
+        text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
+        screen.blit(text_surface, text_rect)
+    timing.flip("instructions")
+
+    if not timing.wait_for_key(pygame.K_SPACE):
+        pygame.quit()
+        quit()
+
+
 # Create or append results to a CSV file
-def save_results(participant_name, participant_number, results, is_first_write=False):
-    output_file = f"{participant_name}_{participant_number}_exp1_results.csv"
+def save_results(output_file, results, is_first_write=False):
     with open(output_file, mode="a", newline="") as file:
         writer = csv.DictWriter(
-            file, fieldnames=["session_number", "emotion", "user_emotion", "reaction_time", "response_type"]
+            file,
+            fieldnames=["session_number", "emotion", "user_emotion", "reaction_time", "response_type"] + FACE_FIELDS
         )
         if is_first_write:
             writer.writeheader()  # Write header only once
         writer.writerows(results)
 
 
-# Load stimuli
-stimuli = []
-for emotion, folder in STIMULI_PATHS.items():
-    for img_file in os.listdir(folder):
-        stimuli.append({"emotion": emotion, "path": os.path.join(folder, img_file)})
-
-# Randomize stimuli
-random.shuffle(stimuli)
-stimuli = stimuli[:TOTAL_TRIALS]  # Limit total trials if TOTAL_TRIALS is set
-
-# Get participant info
-participant_name, participant_number = get_participant_info()
-if not participant_name or not participant_number:
-    pygame.quit()
-    quit()
+# Index the face images (once per process)
+@functools.lru_cache(maxsize=None)
+def load_faces():
+    face_paths = preprocess_faces.load_face_paths() if USE_PREPROCESSED_FACES else {}
+    return catalog.StimulusCatalog.from_folders(STIMULI_PATHS, face_paths)
 
-# Instructions
-screen.fill(WHITE)
-lines = INSTRUCTIONS.split("\n")
-for i, line in enumerate(lines):
-    text_surface = font.render(line, True, BLACK)
-    text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
-    screen.blit(text_surface, text_rect)
-pygame.display.flip()
-
-waiting_for_space = True
-while waiting_for_space:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            quit()
-        elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-            waiting_for_space = False
-
-# Initialize experiment variables
-results = []
-session_number = 1
-first_write = True
-
-# Run trials
-for trial_index, trial in enumerate(stimuli):
-    # Fixation cross
-    screen.fill(WHITE)
-    text_surface = font.render("+", True, BLACK)
-    text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
-    screen.blit(text_surface, text_rect)
-    pygame.display.flip()
-    pygame.time.delay(int(FIXATION_TIME * 1000))
 
-    # Show stimulus
-    img = pygame.image.load(trial["path"])
-    img = pygame.transform.scale(img, (400, 400))  # Resize the image
-    img_rect = img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
-    screen.fill(WHITE)
-    screen.blit(img, img_rect)  # Center the image
-    pygame.display.flip()  # Render the image on the screen
-
-    # Start response window only after image is displayed
-    start_time = time.time()
-    response = None
-    reaction_time = None
-    correct = False
-    user_emotion = None
-    while time.time() - start_time < RESPONSE_WINDOW:
-        for event in pygame.event.get():
+# Load stimuli
+def load_stimuli():
+    faces = load_faces()
+    stimuli = []
+    for emotion, rows in faces.by_emotion.items():
+        for row in rows:
+            stimuli.append({"emotion": emotion, **faces.describe(row, "face")})
+
+    # Randomize stimuli and limit total trials if TOTAL_TRIALS is set
+    return schedules.sample_stimuli(stimuli, TOTAL_TRIALS)
+
+
+# A new face of the given emotion to repeat a late trial with, one that is not
+# in the schedule yet when the pool allows
+def draw_face(emotion, schedule):
+    faces = load_faces()
+    scheduled = {trial["face_path"] for trial in schedule}
+    rows = [row for row in faces.by_emotion[emotion] if faces.paths[row] not in scheduled]
+    row = random.choice(rows) if rows else faces.sample(emotion)
+    return {"emotion": emotion, **faces.describe(row, "face")}
+
+
+# Settings recorded in the trial journal
+def journal_settings():
+    return {
+        "FIXATION_TIME": FIXATION_TIME,
+        "RESPONSE_WINDOW": RESPONSE_WINDOW,
+        "FEEDBACK_TIME": FEEDBACK_TIME,
+        "BREAK_INTERVAL": BREAK_INTERVAL,
+        "TOTAL_TRIALS": TOTAL_TRIALS,
+        "EARLY_STOPPING": EARLY_STOPPING,
+        "MIN_TRIALS_PER_CONDITION": MIN_TRIALS_PER_CONDITION,
+        "RT_PRECISION": RT_PRECISION,
+        "ACCURACY_PRECISION": ACCURACY_PRECISION,
+        "FRAME_CHECK": FRAME_CHECK,
+        "FRAME_TOLERANCE": FRAME_TOLERANCE,
+    }
+
+
+# Check that this station can keep the timing budget. Returns False when
+# the session must not start.
+def run_preflight():
+    budget = {
+        "FIXATION_TIME": FIXATION_TIME,
+        "RESPONSE_WINDOW": RESPONSE_WINDOW,
+    }
+    sources = [(load_faces().paths, (400, 400))]
+    return preflight.run("exp_1", screen, budget, sources, PREFLIGHT)
+
+
+# Wait for a keypress during the response window that starts at start_time.
+# Returns (key, reaction_time), or (None, None) if no key was pressed.
+def collect_response(start_time):
+    while timing.now() - start_time < RESPONSE_WINDOW:
+        for event in timing.get_events():
             if event.type == pygame.KEYDOWN:
-                response = event.key
-                end_time = time.time()
-                reaction_time = end_time - start_time
-
-                # Determine user input emotion
-                for emotion, key in key_mapping.items():
-                    if response == key:
-                        user_emotion = emotion
-                        break
-
-                # Check correctness
-                correct = trial["emotion"] == user_emotion
-                break
-        if response:
-            break
+                return event.key, timing.now() - start_time
+    return None, None
 
-    # Only log valid responses
-    if response:
-        response_type = "Correct" if correct else "Incorrect"
-        results.append({
-            "session_number": session_number,
-            "emotion": trial["emotion"],
-            "user_emotion": user_emotion,
-            "reaction_time": reaction_time,
-            "response_type": response_type,
-        })
-
-        # Feedback
+
+# Stopping rule over the conditions in the schedule, or None when early stopping is off
+def make_stopping_rule(conditions):
+    if not EARLY_STOPPING:
+        return None
+    return early_stopping.StoppingRule(set(conditions), MIN_TRIALS_PER_CONDITION, RT_PRECISION, ACCURACY_PRECISION)
+
+
+# Run experiment
+def run_experiment(stimuli, output_file, trial_journal=None, publisher=None, marker_output=None):
+    results = []
+    session_number = 1
+    first_write = True
+    stopping_rule = make_stopping_rule(trial["emotion"] for trial in stimuli)
+    schedule = list(stimuli)   # Grows when late trials are repeated
+    requeues = 0
+
+    for trial_index, trial in enumerate(schedule):
+        # Fixation cross
         screen.fill(WHITE)
-        feedback_color = (0, 255, 0) if response_type == "Correct" else (255, 0, 0)
-        text_surface = font.render(response_type, True, feedback_color)
+        text_surface = font.render("+", True, BLACK)
         text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         screen.blit(text_surface, text_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(FEEDBACK_TIME * 1000))
+        if marker_output:
+            marker_output.arm("fixation", trial_index)
+        fixation_time = timing.flip("fixation")
 
-    # Break after specified interval
-    if (trial_index + 1) % BREAK_INTERVAL == 0 and trial_index + 1 < TOTAL_TRIALS:
-        # Save results so far
-        save_results(participant_name, participant_number, results, is_first_write=first_write)
-        first_write = False  # Header already written
-        results = []  # Clear results for the next session
+        # Load the stimulus while the fixation cross is shown; the time it
+        # takes comes off the fixation wait
+        img = image_cache.load(trial["face_path"], (400, 400))  # Decoded and resized once
+        img_rect = img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+        timing.delay_before_flip(FIXATION_TIME, fixation_time)
 
-        # Increment session number
-        session_number += 1
-
-        # Display break screen
-        remaining_trials = TOTAL_TRIALS - (trial_index + 1)
+        # Show stimulus
         screen.fill(WHITE)
-        rest_lines = [BREAK_TEXT, f"Trials Remaining: {remaining_trials}"]
-        for i, line in enumerate(rest_lines):
-            text_surface = font.render(line, True, BLACK)
-            text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
+        screen.blit(img, img_rect)  # Center the image
+
+        # Start response window only after image is displayed
+        if marker_output:
+            marker_output.arm(f"stimulus/{trial['emotion']}", trial_index)
+        start_time = timing.flip("stimulus")
+        response, reaction_time = collect_response(start_time)
+
+        # Determine user input emotion
+        user_emotion = None
+        for emotion, key in key_mapping.items():
+            if response == key:
+                user_emotion = emotion
+                break
+
+        # Was the stimulus shown on time?
+        late = None
+        if FRAME_CHECK:
+            late = timing.check_phases([("fixation", fixation_time, FIXATION_TIME)], start_time, FRAME_TOLERANCE)
+
+        # Check correctness
+        correct = response is not None and trial["emotion"] == user_emotion
+        if marker_output:
+            marker_output.send_response(trial_index, start_time, correct, reaction_time)
+
+        if trial_journal:
+            journal.write_trial(trial_journal, trial_index, trial, response, reaction_time, late)
+        if late:
+            # Leave the trial out of the results and run its emotion again
+            # later with a face the participant has not been shown
+            if not requeue_late_trials:
+                print(f"Trial {trial_index} was late ({late})")
+            elif requeues < MAX_REQUEUES:
+                schedules.requeue(schedule, trial_index, draw_face(trial["emotion"], schedule))
+                requeues += 1
+                print(f"Trial {trial_index} was late ({late}), repeated later")
+            else:
+                print(f"ERROR: trial {trial_index} was late ({late}) after {MAX_REQUEUES} trials were repeated; "
+                      f"this station cannot keep the timing, block stopped")
+                break
+        elif publisher:
+            publisher.send_trial(trial_index, trial["emotion"], response, correct, reaction_time)
+
+        # Only log valid responses
+        if response:
+            response_type = "Correct" if correct else "Incorrect"
+            if not late:
+                results.append({
+                    "session_number": session_number,
+                    "emotion": trial["emotion"],
+                    "user_emotion": user_emotion,
+                    "reaction_time": reaction_time,
+                    "response_type": response_type,
+                    **{field: trial[field] for field in FACE_FIELDS}
+                })
+
+            # Feedback
+            screen.fill(WHITE)
+            feedback_color = (0, 255, 0) if response_type == "Correct" else (255, 0, 0)
+            text_surface = font.render(response_type, True, feedback_color)
+            text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
             screen.blit(text_surface, text_rect)
-        pygame.display.flip()
-
-        waiting_for_space = True
-        while waiting_for_space:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    quit()
-                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                    waiting_for_space = False
-
-# Save final session results
-if results:
-    save_results(participant_name, participant_number, results, is_first_write=first_write)
-
-# End of experiment
-screen.fill(WHITE)
-text_surface = font.render("Experiment Completed! Results saved.", True, BLACK)
-text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
-screen.blit(text_surface, text_rect)
-pygame.display.flip()
-pygame.time.delay(3000)
-
-pygame.quit()
\ No newline at end of file
+            timing.flip("feedback")
+            timing.delay(FEEDBACK_TIME)
+
+        # Stop once every emotion is estimated precisely enough, counting only
+        # the trials written to the results (misses are not)
+        logged = response is not None and not late
+        if stopping_rule and logged and stopping_rule.add(trial["emotion"], correct, reaction_time):
+            print(f"Stopped early after {trial_index + 1} trials: all conditions reached the target precision")
+            break
+
+        # Break after specified interval
+        if (trial_index + 1) % BREAK_INTERVAL == 0 and trial_index + 1 < len(schedule):
+            # Save results so far
+            save_results(output_file, results, is_first_write=first_write)
+            first_write = False  # Header already written
+            results = []  # Clear results for the next session
+
+            # Increment session number
+            session_number += 1
+
+            # Display break screen
+            remaining_trials = len(schedule) - (trial_index + 1)
+            screen.fill(WHITE)
+            rest_lines = [BREAK_TEXT, f"Trials Remaining: {remaining_trials}"]
+            for i, line in enumerate(rest_lines):
+                text_surface = font.render(line, True, BLACK)
+                text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
+                screen.blit(text_surface, text_rect)
+            timing.flip("break")
+
+            if not timing.wait_for_key(pygame.K_SPACE):
+                pygame.quit()
+                quit()
+
+    # Save final session results
+    if results:
+        save_results(output_file, results, is_first_write=first_write)
+
+
+# Run the experiment for one participant
+def run_session(participant_name, participant_number):
+    # Index stimuli only once the window is up and the participant is known
+    stimuli = load_stimuli()
+
+    output_file = f"{participant_name}_{participant_number}_exp1_results.csv"
+    journal_file = f"{participant_name}_{participant_number}_exp1_journal.jsonl"
+    marker_log_file = f"{participant_name}_{participant_number}_exp1_markers.csv"
+
+    display_instructions()
+    trial_journal = journal.open_journal(
+        journal_file, "exp_1", participant_name, participant_number, journal_settings(), stimuli
+    )
+    publisher = monitor.open_publisher(
+        MONITOR_ADDRESS, "exp_1", f"{participant_name}_{participant_number}", len(key_mapping)
+    )
+    marker_output = markers.open_output(MARKER_ADDRESS, list(STIMULI_PATHS), marker_log_file)
+    try:
+        run_experiment(stimuli, output_file, trial_journal, publisher, marker_output)
+    finally:
+        trial_journal.close()
+        if publisher:
+            publisher.close()
+        if marker_output:
+            marker_output.close()
+
+
+# Main execution
+def main():
+    if screen is None:
+        init_display()
+
+    if not run_preflight():
+        pygame.quit()
+        return
+
+    # Get participant info
+    participant_name, participant_number = get_participant_info()
+    if not participant_name or not participant_number:
+        pygame.quit()
+        return
+
+    run_session(participant_name, participant_number)
+
+    # End of experiment
+    screen.fill(WHITE)
+    text_surface = font.render("Experiment Completed! Results saved.", True, BLACK)
+    text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+    screen.blit(text_surface, text_rect)
+    timing.flip("end")
+    pygame.time.delay(3000)
+
+
+if __name__ == "__main__":
+    main()
+    pygame.quit()
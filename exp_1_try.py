@@ -1,7 +1,12 @@
 import pygame
+import functools
 import os
-import random
-import time
+
+import image_cache
+import preprocess_faces
+import render_backend
+import schedules
+import timing
 
 # ===============================
 # Customizable Variables
@@ -10,6 +15,7 @@ import time
 # Window settings
 WINDOW_WIDTH = 1200
 WINDOW_HEIGHT = 800
+RENDER_BACKEND = "surface"    # "surface" or "texture" (SDL2 renderer, see render_backend.py)
 
 # Time settings (in seconds)
 FIXATION_TIME = 0.5           # Duration of fixation cross
@@ -35,6 +41,9 @@ STIMULI_PATHS = {
     "angry": "distractors/angry"
 }
 
+# Load faces preprocessed by preprocess_faces.py (cropped and resampled) when available
+USE_PREPROCESSED_FACES = True
+
 # Key mappings
 key_mapping = {"happy": pygame.K_j, "neutral": pygame.K_k, "angry": pygame.K_l}
 
@@ -42,17 +51,24 @@ key_mapping = {"happy": pygame.K_j, "neutral": pygame.K_k, "angry": pygame.K_l}
 # Practice Program Code
 # ===============================
 
-pygame.init()
-
-# Screen settings
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption("Emotion Categorization Practice")
-font = pygame.font.Font(None, 50)
+screen = None
+font = None
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
 
+# Open the practice window (only the display and font modules are initialized)
+def init_display():
+    global screen, font
+    pygame.display.init()
+    pygame.font.init()
+    screen = render_backend.open_window(
+        (WINDOW_WIDTH, WINDOW_HEIGHT), "Emotion Categorization Practice", RENDER_BACKEND
+    )
+    font = render_backend.CachedFont(None, 50)
+
+
 # Function to calculate break statistics
 def calculate_stats(session_results):
     total_trials = len(session_results)
@@ -65,140 +81,151 @@ def calculate_stats(session_results):
     return accuracy, avg_reaction_time
 
 
+# Function to display practice instructions
+def display_instructions():
+    screen.fill(WHITE)
+    lines = INSTRUCTIONS.split("\n")
+    for i, line in enumerate(lines):
+        text_surface = font.render(line, True, BLACK)
+        text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
+        screen.blit(text_surface, text_rect)
+    timing.flip("instructions")
+
+    if not timing.wait_for_key(pygame.K_SPACE):
+        pygame.quit()
+        quit()
+
+
+# List the face images (once per process)
+@functools.lru_cache(maxsize=None)
+def load_faces():
+    face_paths = preprocess_faces.load_face_paths() if USE_PREPROCESSED_FACES else {}
+    faces = []
+    for emotion, folder in STIMULI_PATHS.items():
+        for img_file in os.listdir(folder):
+            path = os.path.join(folder, img_file)
+            faces.append({"emotion": emotion, "path": face_paths.get(path, path)})
+    return faces
+
+
 # Load stimuli
-stimuli = []
-for emotion, folder in STIMULI_PATHS.items():
-    for img_file in os.listdir(folder):
-        stimuli.append({"emotion": emotion, "path": os.path.join(folder, img_file)})
+def load_stimuli():
+    # Randomize stimuli and limit total trials if TOTAL_TRIALS is set
+    return schedules.sample_stimuli(load_faces(), TOTAL_TRIALS)
 
-# Randomize stimuli
-random.shuffle(stimuli)
-stimuli = stimuli[:TOTAL_TRIALS]  # Limit total trials if TOTAL_TRIALS is set
 
-# Instructions
-screen.fill(WHITE)
-lines = INSTRUCTIONS.split("\n")
-for i, line in enumerate(lines):
-    text_surface = font.render(line, True, BLACK)
-    text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
-    screen.blit(text_surface, text_rect)
-pygame.display.flip()
-
-waiting_for_space = True
-while waiting_for_space:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            quit()
-        elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-            waiting_for_space = False
-
-# Initialize practice session variables
-session_results = []
-
-# Run trials
-for trial_index, trial in enumerate(stimuli):
-    # Fixation cross
+# Run practice trials
+def run_practice(stimuli):
+    session_results = []
+
+    for trial_index, trial in enumerate(stimuli):
+        # Fixation cross
+        screen.fill(WHITE)
+        text_surface = font.render("+", True, BLACK)
+        text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+        screen.blit(text_surface, text_rect)
+        timing.flip("fixation")
+        timing.delay(FIXATION_TIME)
+
+        # Show stimulus
+        img = image_cache.load(trial["path"], (400, 400))  # Decoded and resized once
+        img_rect = img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+        screen.fill(WHITE)
+        screen.blit(img, img_rect)  # Center the image
+
+        # Start response window only after image is displayed
+        start_time = timing.flip("stimulus")
+        response = None
+        reaction_time = None
+        correct = False
+        user_emotion = None
+        while timing.now() - start_time < RESPONSE_WINDOW:
+            for event in timing.get_events():
+                if event.type == pygame.KEYDOWN:
+                    response = event.key
+                    end_time = timing.now()
+                    reaction_time = end_time - start_time
+
+                    # Determine user input emotion
+                    for emotion, key in key_mapping.items():
+                        if response == key:
+                            user_emotion = emotion
+                            break
+
+                    # Check correctness
+                    correct = trial["emotion"] == user_emotion
+                    break
+            if response:
+                break
+
+        # Record the trial result
+        session_results.append({
+            "reaction_time": reaction_time if response else None,
+            "correct": correct,
+        })
+
+        # Feedback
+        feedback_color = (0, 255, 0) if correct else (255, 0, 0)
+        feedback_text = "Correct" if correct else "Incorrect"
+        screen.fill(WHITE)
+        feedback_surface = font.render(feedback_text, True, feedback_color)
+        feedback_rect = feedback_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+        screen.blit(feedback_surface, feedback_rect)
+        timing.flip("feedback")
+        timing.delay(FEEDBACK_TIME)
+
+        # Break after specified interval
+        if (trial_index + 1) % BREAK_INTERVAL == 0 and trial_index + 1 < len(stimuli):
+            # Calculate stats
+            accuracy, avg_reaction_time = calculate_stats(session_results)
+
+            # Display break screen with stats
+            screen.fill(WHITE)
+            rest_lines = [
+                BREAK_TEXT,
+                f"Accuracy: {accuracy:.2f}%",
+                f"Average Reaction Time: {avg_reaction_time:.2f} seconds",
+            ]
+            for i, line in enumerate(rest_lines):
+                text_surface = font.render(line, True, BLACK)
+                text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
+                screen.blit(text_surface, text_rect)
+            timing.flip("break")
+
+            if not timing.wait_for_key(pygame.K_SPACE):
+                pygame.quit()
+                quit()
+
+            # Reset session results
+            session_results = []
+
+
+# Run the practice block
+def run_session():
+    display_instructions()
+    stimuli = load_stimuli()
+    run_practice(stimuli)
+
+
+# Main execution
+def main():
+    if screen is None:
+        init_display()
+
+    run_session()
+
+    # End of practice session
     screen.fill(WHITE)
-    text_surface = font.render("+", True, BLACK)
+    text_surface = font.render("Practice Completed! Press ESC to exit.", True, BLACK)
     text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
     screen.blit(text_surface, text_rect)
-    pygame.display.flip()
-    pygame.time.delay(int(FIXATION_TIME * 1000))
+    timing.flip("end")
 
-    # Show stimulus
-    img = pygame.image.load(trial["path"])
-    img = pygame.transform.scale(img, (400, 400))  # Resize the image
-    img_rect = img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
-    screen.fill(WHITE)
-    screen.blit(img, img_rect)  # Center the image
-    pygame.display.flip()  # Render the image on the screen
-
-    # Start response window only after image is displayed
-    start_time = time.time()
-    response = None
-    reaction_time = None
-    correct = False
-    user_emotion = None
-    while time.time() - start_time < RESPONSE_WINDOW:
-        for event in pygame.event.get():
-            if event.type == pygame.KEYDOWN:
-                response = event.key
-                end_time = time.time()
-                reaction_time = end_time - start_time
-
-                # Determine user input emotion
-                for emotion, key in key_mapping.items():
-                    if response == key:
-                        user_emotion = emotion
-                        break
-
-                # Check correctness
-                correct = trial["emotion"] == user_emotion
-                break
-        if response:
-            break
-
-    # Record the trial result
-    session_results.append({
-        "reaction_time": reaction_time if response else None,
-        "correct": correct,
-    })
-
-    # Feedback
-    feedback_color = (0, 255, 0) if correct else (255, 0, 0)
-    feedback_text = "Correct" if correct else "Incorrect"
-    screen.fill(WHITE)
-    feedback_surface = font.render(feedback_text, True, feedback_color)
-    feedback_rect = feedback_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
-    screen.blit(feedback_surface, feedback_rect)
-    pygame.display.flip()
-    pygame.time.delay(int(FEEDBACK_TIME * 1000))
-
-    # Break after specified interval
-    if (trial_index + 1) % BREAK_INTERVAL == 0 and trial_index + 1 < TOTAL_TRIALS:
-        # Calculate stats
-        accuracy, avg_reaction_time = calculate_stats(session_results)
-
-        # Display break screen with stats
-        screen.fill(WHITE)
-        rest_lines = [
-            BREAK_TEXT,
-            f"Accuracy: {accuracy:.2f}%",
-            f"Average Reaction Time: {avg_reaction_time:.2f} seconds",
-        ]
-        for i, line in enumerate(rest_lines):
-            text_surface = font.render(line, True, BLACK)
-            text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
-            screen.blit(text_surface, text_rect)
-        pygame.display.flip()
-
-        waiting_for_space = True
-        while waiting_for_space:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    quit()
-                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                    waiting_for_space = False
-
-        # Reset session results
-        session_results = []
-
-# End of practice session
-screen.fill(WHITE)
-text_surface = font.render("Practice Completed! Press ESC to exit.", True, BLACK)
-text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
-screen.blit(text_surface, text_rect)
-pygame.display.flip()
-
-waiting_for_exit = True
-while waiting_for_exit:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            quit()
-        elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-            waiting_for_exit = False
-
-pygame.quit()
\ No newline at end of file
+    if not timing.wait_for_key(pygame.K_ESCAPE):
+        pygame.quit()
+        quit()
+
+
+if __name__ == "__main__":
+    main()
+    pygame.quit()
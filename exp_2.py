@@ -2,7 +2,19 @@ import pygame
 import os
 import random
 import csv
-import time
+import functools
+
+import catalog
+import early_stopping
+import image_cache
+import journal
+import markers
+import monitor
+import preflight
+import preprocess_faces
+import render_backend
+import schedules
+import timing
 
 # ===============================
 # Customizable Variables
@@ -11,6 +23,7 @@ import time
 # Window settings
 WINDOW_WIDTH = 1200
 WINDOW_HEIGHT = 800
+RENDER_BACKEND = "surface"    # "surface" or "texture" (SDL2 renderer, see render_backend.py)
 
 # Time settings (in seconds)
 FIXATION_TIME = 0.5           # Duration of fixation cross
@@ -25,6 +38,25 @@ BREAK_TEXT = "Take a short break! Press SPACE to continue."
 # Trial settings
 TOTAL_TRIALS = 200             # Total number of trials in the experiment
 
+# Early stopping: end the block once the 95% confidence intervals of every
+# condition are narrow enough (TOTAL_TRIALS remains the maximum)
+EARLY_STOPPING = False
+MIN_TRIALS_PER_CONDITION = 20 # Never stop before each condition has this many trials
+RT_PRECISION = 0.05           # Largest allowed half-width for mean reaction time (seconds)
+ACCURACY_PRECISION = 0.10     # Largest allowed half-width for accuracy (proportion)
+
+# Frame timing: a trial whose distractor or stimulus flip missed its refresh
+# (the fixation or distractor-only phase was more than half a frame, or
+# FRAME_TOLERANCE without vsync, off its configured duration) is thrown out
+# and repeated later with the same shape and distractor type
+FRAME_CHECK = True
+FRAME_TOLERANCE = 0.017       # Seconds, used when flips are not vsync'd
+MAX_REQUEUES = 50             # Most trials repeated per session; one more late trial stops the block
+
+# Station check before the participant form (see preflight.py): "warn" prints
+# what cannot keep the timing budget, "refuse" does not start, None skips it
+PREFLIGHT = "warn"
+
 # Instructions
 INSTRUCTIONS = ("Primary Task: Categorize the shape in the center.\n"
                 "Press J for Circle, K for Square, L for Triangle.\n"
@@ -44,6 +76,16 @@ DISTRACTORS_PATHS = {
     "neutral": "distractors/neutral"
 }
 
+# Load faces preprocessed by preprocess_faces.py (cropped and resampled) when available
+USE_PREPROCESSED_FACES = True
+
+# Live monitoring: per-trial events are sent here for monitor.py (None to disable)
+MONITOR_ADDRESS = ("127.0.0.1", 47001)
+
+# Event markers: trigger codes sent right after each stimulus flip, for
+# co-registration with physiological recordings (None to disable; see markers.py)
+MARKER_ADDRESS = None
+
 # Key mappings for the primary task
 key_mapping = {"circle": pygame.K_j, "square": pygame.K_k, "triangle": pygame.K_l}
 
@@ -51,16 +93,49 @@ key_mapping = {"circle": pygame.K_j, "square": pygame.K_k, "triangle": pygame.K_
 # Experiment Code
 # ===============================
 
-pygame.init()
+screen = None
+font = None
 
-# Screen settings
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption("Emotion Categorization Experiment 2")
-font = pygame.font.Font(None, 50)
+# Replays turn this off: their schedule already holds the repeated late trials
+requeue_late_trials = True
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
+# Attributes of the distractor image recorded with every trial
+DISTRACTOR_FIELDS = [f"distractor_{attribute}" for attribute in catalog.ATTRIBUTES]
+
+
+# Open the experiment window (only the display and font modules are initialized)
+def init_display():
+    global screen, font
+    pygame.display.init()
+    pygame.font.init()
+    screen = render_backend.open_window(
+        (WINDOW_WIDTH, WINDOW_HEIGHT), "Emotion Categorization Experiment 2", RENDER_BACKEND
+    )
+    font = render_backend.CachedFont(None, 50)
+
+
+# Function to draw the participant info input form
+def draw_participant_form(instructions, participant_name, participant_number):
+    screen.fill(WHITE)
+
+    for i, text in enumerate(instructions):
+        text_surface = font.render(text, True, BLACK)
+        text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 100 + i * 100))
+        screen.blit(text_surface, text_rect)
+
+    name_surface = font.render(f"Name: {participant_name}", True, BLACK)
+    name_rect = name_surface.get_rect(center=(WINDOW_WIDTH // 2, 400))
+    screen.blit(name_surface, name_rect)
+
+    number_surface = font.render(f"Number: {participant_number}", True, BLACK)
+    number_rect = number_surface.get_rect(center=(WINDOW_WIDTH // 2, 500))
+    screen.blit(number_surface, number_rect)
+
+    timing.flip("participant_form")
+
 
 # Function to display participant info input form
 def get_participant_info():
@@ -73,31 +148,23 @@ def get_participant_info():
         "Enter Participant Number:",
         "Press ENTER to start the experiment."
     ]
+    needs_redraw = True
 
     while True:
-        screen.fill(WHITE)
-
-        for i, text in enumerate(instructions):
-            text_surface = font.render(text, True, BLACK)
-            text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 100 + i * 100))
-            screen.blit(text_surface, text_rect)
-
-        name_surface = font.render(f"Name: {participant_name}", True, BLACK)
-        name_rect = name_surface.get_rect(center=(WINDOW_WIDTH // 2, 400))
-        screen.blit(name_surface, name_rect)
+        # Redraw only when the form has changed
+        if needs_redraw:
+            draw_participant_form(instructions, participant_name, participant_number)
+            needs_redraw = False
 
-        number_surface = font.render(f"Number: {participant_number}", True, BLACK)
-        number_rect = number_surface.get_rect(center=(WINDOW_WIDTH // 2, 500))
-        screen.blit(number_surface, number_rect)
-
-        pygame.display.flip()
-
-        for event in pygame.event.get():
+        for event in timing.wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 return None, None
 
-            if event.type == pygame.KEYDOWN:
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                needs_redraw = True
+            elif event.type == pygame.KEYDOWN:
+                needs_redraw = True
                 if active_field == "name":
                     if event.key == pygame.K_RETURN:
                         active_field = "number"
@@ -122,16 +189,11 @@ def display_instructions():
         text_surface = font.render(line, True, BLACK)
         text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
         screen.blit(text_surface, text_rect)
-    pygame.display.flip()
+    timing.flip("instructions")
 
-    waiting_for_space = True
-    while waiting_for_space:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                waiting_for_space = False
+    if not timing.wait_for_key(pygame.K_SPACE):
+        pygame.quit()
+        quit()
 
 
 # Save results to CSV
@@ -144,7 +206,7 @@ def save_results_to_csv(filename, results, is_first_write=False):
             "response",
             "reaction_time",
             "correctness"
-        ]
+        ] + DISTRACTOR_FIELDS + ["shape_id"]
         writer = csv.DictWriter(file, fieldnames=fieldnames)
         if is_first_write:
             writer.writeheader()  # Write header only once
@@ -162,15 +224,15 @@ def load_images(folder):
     return images
 
 
-# Load distractors
+# Load distractors into a catalog indexed by emotion, sex and identity (once per process)
+@functools.lru_cache(maxsize=None)
 def load_distractors():
-    distractors = {"happy": [], "angry": [], "neutral": []}
-    for category, folder in DISTRACTORS_PATHS.items():
-        distractors[category].extend(load_images(folder))
-    return distractors
+    face_paths = preprocess_faces.load_face_paths() if USE_PREPROCESSED_FACES else {}
+    return catalog.StimulusCatalog.from_folders(DISTRACTORS_PATHS, face_paths)
 
 
-# Load shapes
+# Load shapes (once per process)
+@functools.lru_cache(maxsize=None)
 def load_shapes():
     shapes = {"circle": [], "square": [], "triangle": []}
     for shape, folder in SHAPES_PATH.items():
@@ -180,82 +242,153 @@ def load_shapes():
 
 # Trial generation
 def generate_trials():
-    trials = []
     shapes = list(SHAPES_PATH.keys())
     distractor_types = list(DISTRACTORS_PATHS.keys())
+    return schedules.generate_trials(shapes, distractor_types, TOTAL_TRIALS)
+
+
+# Settings recorded in the trial journal
+def journal_settings():
+    return {
+        "FIXATION_TIME": FIXATION_TIME,
+        "DISTRACTOR_ONLY_TIME": DISTRACTOR_ONLY_TIME,
+        "RESPONSE_WINDOW": RESPONSE_WINDOW,
+        "FEEDBACK_TIME": FEEDBACK_TIME,
+        "BREAK_INTERVAL": BREAK_INTERVAL,
+        "TOTAL_TRIALS": TOTAL_TRIALS,
+        "EARLY_STOPPING": EARLY_STOPPING,
+        "MIN_TRIALS_PER_CONDITION": MIN_TRIALS_PER_CONDITION,
+        "RT_PRECISION": RT_PRECISION,
+        "ACCURACY_PRECISION": ACCURACY_PRECISION,
+        "FRAME_CHECK": FRAME_CHECK,
+        "FRAME_TOLERANCE": FRAME_TOLERANCE,
+    }
+
+
+# Check that this station can keep the timing budget. Returns False when
+# the session must not start.
+def run_preflight():
+    budget = {
+        "FIXATION_TIME": FIXATION_TIME,
+        "DISTRACTOR_ONLY_TIME": DISTRACTOR_ONLY_TIME,
+        "RESPONSE_WINDOW": RESPONSE_WINDOW,
+    }
+    shape_paths = [path for paths in load_shapes().values() for path in paths]
+    sources = [(load_distractors().paths, (400, 400)), (shape_paths, (200, 200))]
+    return preflight.run("exp_2", screen, budget, sources, PREFLIGHT)
+
+
+# Wait for a keypress during the response window that starts at start_time.
+# Returns (key, reaction_time), or (None, None) if no key was pressed.
+def collect_response(start_time):
+    while timing.now() - start_time < RESPONSE_WINDOW:
+        for event in timing.get_events():
+            if event.type == pygame.KEYDOWN:
+                return event.key, timing.now() - start_time
+    return None, None
+
 
-    for _ in range(TOTAL_TRIALS):
-        shape = random.choice(shapes)
-        distractor_type = random.choice(distractor_types)
-        trials.append({"shape": shape, "distractor_type": distractor_type})
-    random.shuffle(trials)
-    return trials
+# Stopping rule over the conditions in the schedule, or None when early stopping is off
+def make_stopping_rule(conditions):
+    if not EARLY_STOPPING:
+        return None
+    return early_stopping.StoppingRule(set(conditions), MIN_TRIALS_PER_CONDITION, RT_PRECISION, ACCURACY_PRECISION)
 
 
 # Run experiment
-def run_experiment(trials, shapes, distractors, output_file):
+def run_experiment(trials, shapes, distractors, output_file, trial_journal=None, publisher=None, marker_output=None):
     results = []
     session_number = 1
     is_first_write = True
+    stopping_rule = make_stopping_rule(trial["distractor_type"] for trial in trials)
+    schedule = list(trials)   # Grows when late trials are repeated
+    requeues = 0
 
-    for trial_index, trial in enumerate(trials):
+    for trial_index, trial in enumerate(schedule):
         # Fixation cross
         screen.fill(WHITE)
         fixation = font.render("+", True, BLACK)
         fixation_rect = fixation.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         screen.blit(fixation, fixation_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(FIXATION_TIME * 1000))
-
-        # Load distractor and shape
-        distractor_img_path = random.choice(distractors[trial["distractor_type"]])
-        distractor_img = pygame.image.load(distractor_img_path)
-        distractor_img = pygame.transform.scale(distractor_img, (400, 400))
+        if marker_output:
+            marker_output.arm("fixation", trial_index)
+        fixation_time = timing.flip("fixation")
+
+        # Load distractor and shape while the fixation cross is shown; the
+        # time it takes comes off the fixation wait (replayed trials already
+        # name their images)
+        if "distractor_path" not in trial:
+            distractor_row = distractors.sample(trial["distractor_type"])
+            trial = dict(trial, **distractors.describe(distractor_row, "distractor"))
+        distractor_img = image_cache.load(trial["distractor_path"], (400, 400))
         distractor_rect = distractor_img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
 
-        shape_img_path = random.choice(shapes[trial["shape"]])
-        shape_img = pygame.image.load(shape_img_path)
-        shape_img = pygame.transform.scale(shape_img, (200, 200))
+        shape_img_path = trial.get("shape_path") or random.choice(shapes[trial["shape"]])
+        shape_img = image_cache.load(shape_img_path, (200, 200))
         shape_rect = shape_img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+        timing.delay_before_flip(FIXATION_TIME, fixation_time)
 
         # Display distractor only (for 1 second)
         screen.fill(WHITE)
         screen.blit(distractor_img, distractor_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(DISTRACTOR_ONLY_TIME * 1000))  # Display distractor for 1 second
+        if marker_output:
+            marker_output.arm("distractor", trial_index)
+        distractor_time = timing.flip("distractor")
+        timing.delay_before_flip(DISTRACTOR_ONLY_TIME)  # Display distractor for 1 second
 
         # Display distractor + shape
         screen.fill(WHITE)
         screen.blit(distractor_img, distractor_rect)  # Draw distractor first
         screen.blit(shape_img, shape_rect)           # Overlay shape
-        pygame.display.flip()
 
         # Collect response
-        start_time = time.time()
-        response = None
-        reaction_time = None
-        correct = False
-
-        while time.time() - start_time < RESPONSE_WINDOW:
-            for event in pygame.event.get():
-                if event.type == pygame.KEYDOWN:
-                    response = event.key
-                    reaction_time = time.time() - start_time
-                    correct = key_mapping[trial["shape"]] == response
-                    break
-            if response:
+        if marker_output:
+            marker_output.arm(f"stimulus/{trial['distractor_type']}/{trial['shape']}", trial_index)
+        start_time = timing.flip("stimulus")
+        response, reaction_time = collect_response(start_time)
+        correct = key_mapping[trial["shape"]] == response
+
+        # Was the stimulus shown on time?
+        late = None
+        if FRAME_CHECK:
+            phases = [("fixation", fixation_time, FIXATION_TIME), ("distractor", distractor_time, DISTRACTOR_ONLY_TIME)]
+            late = timing.check_phases(phases, start_time, FRAME_TOLERANCE)
+        if marker_output:
+            marker_output.send_response(trial_index, start_time, correct, reaction_time)
+
+        if trial_journal:
+            trial_record = dict(trial, shape_path=shape_img_path)
+            journal.write_trial(trial_journal, trial_index, trial_record, response, reaction_time, late)
+        if late:
+            # Leave the trial out of the results and run its shape and
+            # distractor type again later (with newly drawn images)
+            if not requeue_late_trials:
+                print(f"Trial {trial_index} was late ({late})")
+            elif requeues < MAX_REQUEUES:
+                schedules.requeue(schedule, trial_index, schedule[trial_index])
+                requeues += 1
+                print(f"Trial {trial_index} was late ({late}), repeated later")
+            else:
+                print(f"ERROR: trial {trial_index} was late ({late}) after {MAX_REQUEUES} trials were repeated; "
+                      f"this station cannot keep the timing, block stopped")
+                save_results_to_csv(output_file, results, is_first_write)
                 break
-
-        # Log trial result
-        response_str = next((key for key, value in key_mapping.items() if value == response), "No Response")
-        results.append({
-            "session_number": session_number,
-            "distractor_type": trial["distractor_type"],
-            "shape": trial["shape"],
-            "response": response_str,
-            "reaction_time": reaction_time if response else "No Response",
-            "correctness": "Correct" if correct else "Incorrect"
-        })
+        else:
+            if publisher:
+                publisher.send_trial(trial_index, trial["distractor_type"], response, correct, reaction_time)
+
+            # Log trial result
+            response_str = next((key for key, value in key_mapping.items() if value == response), "No Response")
+            results.append({
+                "session_number": session_number,
+                "distractor_type": trial["distractor_type"],
+                "shape": trial["shape"],
+                "response": response_str,
+                "reaction_time": reaction_time if response else "No Response",
+                "correctness": "Correct" if correct else "Incorrect",
+                **{field: trial[field] for field in DISTRACTOR_FIELDS},
+                "shape_id": catalog.item_id(shape_img_path),
+            })
 
         # Feedback
         feedback_color = (0, 255, 0) if correct else (255, 0, 0)
@@ -264,53 +397,83 @@ def run_experiment(trials, shapes, distractors, output_file):
         feedback_surface = font.render(feedback_text, True, feedback_color)
         feedback_rect = feedback_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         screen.blit(feedback_surface, feedback_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(FEEDBACK_TIME * 1000))
+        timing.flip("feedback")
+        timing.delay(FEEDBACK_TIME)
+
+        # Stop once every distractor type is estimated precisely enough
+        if stopping_rule and not late and stopping_rule.add(trial["distractor_type"], correct, reaction_time):
+            save_results_to_csv(output_file, results, is_first_write)
+            print(f"Stopped early after {trial_index + 1} trials: all conditions reached the target precision")
+            break
 
         # Break after specified interval
-        if (trial_index + 1) % BREAK_INTERVAL == 0 or trial_index + 1 == len(trials):
+        if (trial_index + 1) % BREAK_INTERVAL == 0 or trial_index + 1 == len(schedule):
             save_results_to_csv(output_file, results, is_first_write)
             is_first_write = False
             results = []  # Clear results for the next session
             session_number += 1
 
             # Display break screen
-            remaining_trials = TOTAL_TRIALS - (trial_index + 1)
+            remaining_trials = len(schedule) - (trial_index + 1)
             screen.fill(WHITE)
             rest_lines = [BREAK_TEXT, f"Trials Remaining: {remaining_trials}"]
             for i, line in enumerate(rest_lines):
                 text_surface = font.render(line, True, BLACK)
                 text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
                 screen.blit(text_surface, text_rect)
-            pygame.display.flip()
-
-            waiting_for_space = True
-            while waiting_for_space:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        pygame.quit()
-                        quit()
-                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                        waiting_for_space = False
+            timing.flip("break")
 
+            if not timing.wait_for_key(pygame.K_SPACE):
+                pygame.quit()
+                quit()
 
-# Main execution
-def main():
-    participant_name, participant_number = get_participant_info()
-    if not participant_name or not participant_number:
-        pygame.quit()
-        return
 
+# Run the experiment for one participant
+def run_session(participant_name, participant_number):
     output_file = f"{participant_name}_{participant_number}_exp2_results.csv"
+    journal_file = f"{participant_name}_{participant_number}_exp2_journal.jsonl"
+    marker_log_file = f"{participant_name}_{participant_number}_exp2_markers.csv"
 
     display_instructions()
     distractors = load_distractors()
     shapes = load_shapes()
     trials = generate_trials()
-    run_experiment(trials, shapes, distractors, output_file)
+    trial_journal = journal.open_journal(
+        journal_file, "exp_2", participant_name, participant_number, journal_settings(), trials
+    )
+    publisher = monitor.open_publisher(
+        MONITOR_ADDRESS, "exp_2", f"{participant_name}_{participant_number}", len(key_mapping)
+    )
+    stimulus_conditions = [f"{distractor}/{shape}" for distractor in DISTRACTORS_PATHS for shape in SHAPES_PATH]
+    marker_output = markers.open_output(MARKER_ADDRESS, stimulus_conditions, marker_log_file)
+    try:
+        run_experiment(trials, shapes, distractors, output_file, trial_journal, publisher, marker_output)
+    finally:
+        trial_journal.close()
+        if publisher:
+            publisher.close()
+        if marker_output:
+            marker_output.close()
     print(f"Experiment completed. Results saved to {output_file}")
 
 
+# Main execution
+def main():
+    if screen is None:
+        init_display()
+
+    if not run_preflight():
+        pygame.quit()
+        return
+
+    participant_name, participant_number = get_participant_info()
+    if not participant_name or not participant_number:
+        pygame.quit()
+        return
+
+    run_session(participant_name, participant_number)
+
+
 if __name__ == "__main__":
     main()
     pygame.quit()
\ No newline at end of file
@@ -1,7 +1,13 @@
 import pygame
 import os
 import random
-import time
+import functools
+
+import image_cache
+import preprocess_faces
+import render_backend
+import schedules
+import timing
 
 # ===============================
 # Customizable Variables
@@ -10,6 +16,7 @@ import time
 # Window settings
 WINDOW_WIDTH = 1200
 WINDOW_HEIGHT = 800
+RENDER_BACKEND = "surface"    # "surface" or "texture" (SDL2 renderer, see render_backend.py)
 
 # Time settings (in seconds)
 FIXATION_TIME = 0.5           # Duration of fixation cross
@@ -43,6 +50,9 @@ DISTRACTORS_PATHS = {
     "neutral": "distractors/neutral"
 }
 
+# Load faces preprocessed by preprocess_faces.py (cropped and resampled) when available
+USE_PREPROCESSED_FACES = True
+
 # Key mappings for the primary task
 key_mapping = {"circle": pygame.K_j, "square": pygame.K_k, "triangle": pygame.K_l}
 
@@ -50,17 +60,24 @@ key_mapping = {"circle": pygame.K_j, "square": pygame.K_k, "triangle": pygame.K_
 # Experiment Code
 # ===============================
 
-pygame.init()
-
-# Screen settings
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption("Emotion Categorization Experiment (Trial Version)")
-font = pygame.font.Font(None, 50)
+screen = None
+font = None
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
 
+# Open the practice window (only the display and font modules are initialized)
+def init_display():
+    global screen, font
+    pygame.display.init()
+    pygame.font.init()
+    screen = render_backend.open_window(
+        (WINDOW_WIDTH, WINDOW_HEIGHT), "Emotion Categorization Experiment (Trial Version)", RENDER_BACKEND
+    )
+    font = render_backend.CachedFont(None, 50)
+
+
 # Function to display experiment instructions
 def display_instructions():
     screen.fill(WHITE)
@@ -69,16 +86,11 @@ def display_instructions():
         text_surface = font.render(line, True, BLACK)
         text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
         screen.blit(text_surface, text_rect)
-    pygame.display.flip()
+    timing.flip("instructions")
 
-    waiting_for_space = True
-    while waiting_for_space:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                waiting_for_space = False
+    if not timing.wait_for_key(pygame.K_SPACE):
+        pygame.quit()
+        quit()
 
 
 # Load all images from subfolders
@@ -92,15 +104,18 @@ def load_images(folder):
     return images
 
 
-# Load distractors
+# Load distractors (once per process)
+@functools.lru_cache(maxsize=None)
 def load_distractors():
+    face_paths = preprocess_faces.load_face_paths() if USE_PREPROCESSED_FACES else {}
     distractors = {"happy": [], "angry": [], "neutral": []}
     for category, folder in DISTRACTORS_PATHS.items():
-        distractors[category].extend(load_images(folder))
+        distractors[category].extend(face_paths.get(path, path) for path in load_images(folder))
     return distractors
 
 
-# Load shapes
+# Load shapes (once per process)
+@functools.lru_cache(maxsize=None)
 def load_shapes():
     shapes = {"circle": [], "square": [], "triangle": []}
     for shape, folder in SHAPES_PATH.items():
@@ -110,16 +125,9 @@ def load_shapes():
 
 # Trial generation
 def generate_trials():
-    trials = []
     shapes = list(SHAPES_PATH.keys())
     distractor_types = list(DISTRACTORS_PATHS.keys())
-
-    for _ in range(TOTAL_TRIALS):
-        shape = random.choice(shapes)
-        distractor_type = random.choice(distractor_types)
-        trials.append({"shape": shape, "distractor_type": distractor_type})
-    random.shuffle(trials)
-    return trials
+    return schedules.generate_trials(shapes, distractor_types, TOTAL_TRIALS)
 
 
 # Function to calculate break statistics
@@ -145,43 +153,40 @@ def run_experiment(trials, shapes, distractors):
         fixation = font.render("+", True, BLACK)
         fixation_rect = fixation.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         screen.blit(fixation, fixation_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(FIXATION_TIME * 1000))
+        timing.flip("fixation")
+        timing.delay(FIXATION_TIME)
 
         # Load distractor and shape
         distractor_img_path = random.choice(distractors[trial["distractor_type"]])
-        distractor_img = pygame.image.load(distractor_img_path)
-        distractor_img = pygame.transform.scale(distractor_img, (400, 400))
+        distractor_img = image_cache.load(distractor_img_path, (400, 400))
         distractor_rect = distractor_img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
 
         shape_img_path = random.choice(shapes[trial["shape"]])
-        shape_img = pygame.image.load(shape_img_path)
-        shape_img = pygame.transform.scale(shape_img, (200, 200))
+        shape_img = image_cache.load(shape_img_path, (200, 200))
         shape_rect = shape_img.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
 
         # Display distractor only (for 1 second)
         screen.fill(WHITE)
         screen.blit(distractor_img, distractor_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(DISTRACTOR_ONLY_TIME * 1000))  # Display distractor for 1 second
+        timing.flip("distractor")
+        timing.delay(DISTRACTOR_ONLY_TIME)  # Display distractor for 1 second
 
         # Display distractor + shape
         screen.fill(WHITE)
         screen.blit(distractor_img, distractor_rect)  # Draw distractor first
         screen.blit(shape_img, shape_rect)           # Overlay shape
-        pygame.display.flip()
 
         # Collect response
-        start_time = time.time()
+        start_time = timing.flip("stimulus")
         response = None
         reaction_time = None
         correct = False
 
-        while time.time() - start_time < RESPONSE_WINDOW:
-            for event in pygame.event.get():
+        while timing.now() - start_time < RESPONSE_WINDOW:
+            for event in timing.get_events():
                 if event.type == pygame.KEYDOWN:
                     response = event.key
-                    reaction_time = time.time() - start_time
+                    reaction_time = timing.now() - start_time
                     correct = key_mapping[trial["shape"]] == response
                     break
             if response:
@@ -204,8 +209,8 @@ def run_experiment(trials, shapes, distractors):
         feedback_surface = font.render(feedback_text, True, feedback_color)
         feedback_rect = feedback_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         screen.blit(feedback_surface, feedback_rect)
-        pygame.display.flip()
-        pygame.time.delay(int(FEEDBACK_TIME * 1000))
+        timing.flip("feedback")
+        timing.delay(FEEDBACK_TIME)
 
         # Break after specified interval
         if (trial_index + 1) % BREAK_INTERVAL == 0 or trial_index + 1 == len(trials):
@@ -223,25 +228,20 @@ def run_experiment(trials, shapes, distractors):
                 text_surface = font.render(line, True, BLACK)
                 text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, 200 + i * 50))
                 screen.blit(text_surface, text_rect)
-            pygame.display.flip()
+            timing.flip("break")
 
             # Wait for SPACE to continue
-            waiting_for_space = True
-            while waiting_for_space:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        pygame.quit()
-                        quit()
-                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                        waiting_for_space = False
+            if not timing.wait_for_key(pygame.K_SPACE):
+                pygame.quit()
+                quit()
 
             # Clear session results for the next session
             session_results = []
             session_number += 1
 
 
-# Main execution
-def main():
+# Run the practice block
+def run_session():
     display_instructions()
     distractors = load_distractors()
     shapes = load_shapes()
@@ -250,6 +250,14 @@ def main():
     print("Trial completed. No data saved.")
 
 
+# Main execution
+def main():
+    if screen is None:
+        init_display()
+
+    run_session()
+
+
 if __name__ == "__main__":
     main()
     pygame.quit()
\ No newline at end of file
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+import pygame
+
+# ===============================
+# Decoded Image Cache
+# ===============================
+# Stimuli are decoded, resized and converted to the display format once and
+# then kept in memory, so repeated images (and later participants in a
+# session_host.py session) skip pygame.image.load(). The least recently used
+# images are dropped once the cache exceeds CACHE_LIMIT_MB.
+
+CACHE_LIMIT_MB = 512          # Memory budget for decoded images
+
+_images = OrderedDict()       # (path, size) -> Surface, least recently used first
+_cached_bytes = 0
+
+
+def _surface_bytes(img):
+    width, height = img.get_size()
+    return width * height * img.get_bytesize()
+
+
+# Return the image at path scaled to size, decoding it only if it is not cached
+def load(path, size):
+    global _cached_bytes
+    key = (path, size)
+    img = _images.get(key)
+    if img is not None:
+        _images.move_to_end(key)
+        return img
+
+    img = pygame.image.load(path)
+    if img.get_size() != size:
+        img = pygame.transform.scale(img, size)
+    if pygame.display.get_surface() is not None:
+        img = img.convert()   # Match the display format so blits need no conversion
+
+    _images[key] = img
+    _cached_bytes += _surface_bytes(img)
+    while _cached_bytes > CACHE_LIMIT_MB * 1024 * 1024 and len(_images) > 1:
+        _, evicted = _images.popitem(last=False)
+        _cached_bytes -= _surface_bytes(evicted)
+    return img
+
+
+# Decode a set of images ahead of time and return them
+def preload(paths, size):
+    return [load(path, size) for path in paths]
+
+
+def clear():
+    global _cached_bytes
+    _images.clear()
+    _cached_bytes = 0
@@ -0,0 +1,193 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import catalog
+import preprocess_faces
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Stimulus folders to index, as {set name: {category: folder}}
+STIMULUS_SETS = {
+    "faces": {
+        "happy": "distractors/happy",
+        "neutral": "distractors/neutral",
+        "angry": "distractors/angry",
+        "sad": "distractors/sad"
+    },
+    "shapes": {
+        "circle": "shapes/circle",
+        "square": "shapes/square",
+        "triangle": "shapes/triangle"
+    }
+}
+
+# Where the index is written
+INDEX_FILE = "stimulus_stats.csv"
+
+# Images per worker job; each job is processed as NumPy stacks
+CHUNK_SIZE = 64
+
+# Spatial frequency (cycles per pixel) above which spectral energy counts as "high"
+SF_CUTOFF = 0.1
+
+# Width of the image border (pixels) used to estimate the background level
+BORDER_WIDTH = 8
+
+# Luminance difference from the background (0-1) that counts as foreground
+FOREGROUND_THRESHOLD = 0.08
+
+# ===============================
+# Image Statistics Code
+# ===============================
+# Every image is converted to luminance in [0, 1]. For each image we store:
+#   mean_luminance       mean luminance
+#   rms_contrast         standard deviation of luminance
+#   sf_mean_frequency    power-weighted mean radial spatial frequency (cycles/pixel)
+#   sf_high_fraction     share of spectral power above SF_CUTOFF
+#   foreground_fraction  share of pixels that differ from the border (background)
+#                        level, i.e. the face (with hair) or shape area
+# Images of the same size are stacked and processed together. The index is
+# keyed by path and content hash and only images whose file changed are
+# recomputed on later runs. Faces are measured in the preprocessed version
+# the experiments display (see preprocess_faces.py) when one is cached, under
+# the item id of their source file, so the rows match the face_id /
+# distractor_id columns of the results.
+
+FIELDS = [
+    "path", "sha1", "item", "set", "category", "width", "height",
+    "mean_luminance", "rms_contrast", "sf_mean_frequency", "sf_high_fraction", "foreground_fraction",
+    "size_bytes", "mtime"
+]
+STAT_FIELDS = FIELDS[7:12]
+
+
+# Statistics for a stack of equally sized luminance images, shape (n, h, w)
+def stack_statistics(stack):
+    n, height, width = stack.shape
+    flat = stack.reshape(n, -1)
+    mean_luminance = flat.mean(axis=1)
+    rms_contrast = flat.std(axis=1)
+
+    spectrum = np.abs(np.fft.rfft2(stack - mean_luminance[:, None, None])) ** 2
+    fy = np.fft.fftfreq(height)[:, None]
+    fx = np.fft.rfftfreq(width)[None, :]
+    radius = np.sqrt(fx ** 2 + fy ** 2)
+    total_power = spectrum.sum(axis=(1, 2))
+    safe_total = np.where(total_power > 0, total_power, 1.0)
+    sf_mean_frequency = (spectrum * radius).sum(axis=(1, 2)) / safe_total
+    sf_high_fraction = spectrum[:, radius > SF_CUTOFF].sum(axis=1) / safe_total
+
+    border = np.concatenate([
+        stack[:, :BORDER_WIDTH, :].reshape(n, -1),
+        stack[:, -BORDER_WIDTH:, :].reshape(n, -1),
+        stack[:, :, :BORDER_WIDTH].reshape(n, -1),
+        stack[:, :, -BORDER_WIDTH:].reshape(n, -1),
+    ], axis=1)
+    background = np.median(border, axis=1)
+    foreground = np.abs(stack - background[:, None, None]) > FOREGROUND_THRESHOLD
+    foreground_fraction = foreground.reshape(n, -1).mean(axis=1)
+
+    return np.stack([mean_luminance, rms_contrast, sf_mean_frequency, sf_high_fraction, foreground_fraction], axis=1)
+
+
+# Hash, decode and measure one chunk of images (runs in a worker process)
+def process_chunk(entries):
+    rows = []
+    by_size = {}
+    for entry in entries:
+        with open(entry["path"], "rb") as file:
+            data = file.read()
+        img = np.asarray(Image.open(io.BytesIO(data)).convert("L"), dtype=np.float32) / 255.0
+        row = dict(entry, sha1=hashlib.sha1(data).hexdigest(), width=img.shape[1], height=img.shape[0])
+        by_size.setdefault(img.shape, []).append((row, img))
+
+    for group in by_size.values():
+        stats = stack_statistics(np.stack([img for _, img in group]))
+        for (row, _), values in zip(group, stats):
+            row.update({field: float(value) for field, value in zip(STAT_FIELDS, values)})
+            rows.append(row)
+    return rows
+
+
+def load_index(filename=INDEX_FILE):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, newline="") as file:
+        return {row["path"]: row for row in csv.DictReader(file)}
+
+
+def save_index(index, filename=INDEX_FILE):
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        for path in sorted(index):
+            writer.writerow(index[path])
+
+
+# Bring the index up to date with the stimulus folders
+def build_index(stimulus_sets=STIMULUS_SETS, filename=INDEX_FILE, workers=None, force=False):
+    previous = {} if force else load_index(filename)
+    face_paths = preprocess_faces.load_face_paths()
+    index = {}
+    pending = []
+    for set_name, folders in stimulus_sets.items():
+        for category, folder in folders.items():
+            for img_file in sorted(os.listdir(folder)):
+                if not img_file.lower().endswith((".jpg", ".jpeg", ".png")):
+                    continue
+                source = os.path.join(folder, img_file)
+                path = face_paths.get(source, source)   # The file the experiments load
+                stat = os.stat(path)
+                old = previous.get(path)
+                if old and int(old["size_bytes"]) == stat.st_size and float(old["mtime"]) == stat.st_mtime:
+                    index[path] = old
+                    continue
+                pending.append({
+                    "path": path, "item": catalog.item_id(source), "set": set_name, "category": category,
+                    "size_bytes": stat.st_size, "mtime": stat.st_mtime,
+                })
+
+    chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+    if chunks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rows in pool.map(process_chunk, chunks):
+                for row in rows:
+                    index[row["path"]] = row
+    save_index(index, filename)
+    print(f"Indexed {len(pending)} images ({len(index) - len(pending)} unchanged) in {filename}")
+    return index
+
+
+# Add the statistics of each trial's stimulus to result rows, as <prefix>_<stat>.
+# id_field names the column holding the stimulus item (e.g. "face_id").
+def join_stats(rows, id_field, prefix, index=None):
+    index = load_index() if index is None else index
+    by_item = {entry["item"]: entry for entry in index.values()}
+    joined = []
+    for row in rows:
+        entry = by_item.get(row.get(id_field))
+        stats = {f"{prefix}_{field}": (float(entry[field]) if entry else None) for field in STAT_FIELDS}
+        joined.append(dict(row, **stats))
+    return joined
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute low-level image statistics for all stimuli.")
+    parser.add_argument("--output", default=INDEX_FILE, help="Index CSV to create or update")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--force", action="store_true", help="Recompute every image")
+    args = parser.parse_args()
+    build_index(filename=args.output, workers=args.workers, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import json
+
+# ===============================
+# Trial Journal
+# ===============================
+# A journal is a JSON-lines file written alongside the results CSV. The first
+# line describes the session (experiment, settings and the full trial schedule
+# including stimulus paths); every following line records one trial with the
+# key that was pressed and when, relative to stimulus onset. replay.py uses it
+# to play a session back through the experiment code.
+
+
+# Open a new journal and write the session header
+def open_journal(filename, experiment, participant_name, participant_number, settings, schedule):
+    journal = open(filename, mode="w")
+    header = {
+        "type": "session",
+        "experiment": experiment,
+        "participant_name": participant_name,
+        "participant_number": participant_number,
+        "settings": settings,
+        "schedule": schedule,
+    }
+    journal.write(json.dumps(header) + "\n")
+    journal.flush()
+    return journal
+
+
+# Append one trial to the journal. invalid names why the trial was thrown out
+# (it is repeated later in the schedule, see check_phases() in timing.py).
+def write_trial(journal, trial_index, trial, key, reaction_time, invalid=None):
+    entry = {
+        "type": "trial",
+        "trial_index": trial_index,
+        "trial": trial,
+        "key": key,
+        "reaction_time": reaction_time,
+    }
+    if invalid:
+        entry["invalid"] = invalid
+    journal.write(json.dumps(entry) + "\n")
+    journal.flush()
+
+
+# Read a journal back as (header, trials)
+def read_journal(filename):
+    header = None
+    trials = []
+    with open(filename) as journal:
+        for line in journal:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["type"] == "session":
+                header = entry
+            elif entry["type"] == "trial":
+                trials.append(entry)
+    if header is None:
+        raise ValueError(f"No session header in journal: {filename}")
+    return header, trials
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import statistics
+import threading
+import time
+
+from running_stats import percentile
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Background load levels to test (number of busy processes running alongside)
+LOAD_LEVELS = [0, 1, 2, 4]
+
+# Synthetic keypresses per load level
+TRIALS_PER_LEVEL = 1000
+
+# Range of injected reaction times (seconds after the stimulus flip)
+INJECT_MIN = 0.05
+INJECT_MAX = 0.40
+
+# Pause between trials (seconds)
+INTER_TRIAL_TIME = 0.01
+
+# ===============================
+# Latency Harness Code
+# ===============================
+# Measures how much error the response-capture code adds to reaction_time.
+# For every synthetic trial the harness flips a stimulus screen, a helper
+# thread posts a KEYDOWN event at a known delay after the flip, and the
+# experiment's own collect_response() records the reaction time. The error
+# is the recorded reaction time minus the true delay between flip and post.
+# This is repeated under several levels of background CPU load.
+#
+# Usage:
+#   python latency_harness.py exp_2
+#   python latency_harness.py exp_1 --trials 2000 --loads 0 2 --raw errors.csv
+
+
+def burn_cpu():
+    while True:
+        pass
+
+
+# Busy processes are spawned rather than forked so they do not inherit the SDL state
+def start_load(processes):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=burn_cpu, daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def stop_load(workers):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+
+
+# Post a keypress at due_time (perf_counter seconds) and record when it was posted
+def inject_key(pygame, key, due_time, posted):
+    remaining = due_time - time.perf_counter()
+    if remaining > 0.002:
+        time.sleep(remaining - 0.002)
+    while time.perf_counter() < due_time:
+        pass
+    posted.append(time.perf_counter())
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode="", scancode=0))
+
+
+# Run synthetic trials through experiment.collect_response and return the RT errors
+def measure_errors(experiment, pygame, timing, trials, rng):
+    key = next(iter(experiment.key_mapping.values()))
+    errors = []
+    misses = 0
+    for _ in range(trials):
+        pygame.event.clear()
+        experiment.screen.fill(experiment.WHITE)
+        start_time = timing.flip("stimulus")
+
+        posted = []
+        injector = threading.Thread(
+            target=inject_key, args=(pygame, key, start_time + rng.uniform(INJECT_MIN, INJECT_MAX), posted)
+        )
+        injector.start()
+        response, reaction_time = experiment.collect_response(start_time)
+        injector.join()
+
+        if response is None:
+            misses += 1
+        else:
+            errors.append(reaction_time - (posted[0] - start_time))
+        time.sleep(INTER_TRIAL_TIME)
+    return errors, misses
+
+
+SUMMARY_FIELDS = ["load_processes", "trials", "missed", "mean_ms", "sd_ms", "median_ms", "p95_ms", "p99_ms", "max_ms"]
+
+
+# Summary row for one load level; the error statistics are left empty when
+# every trial was missed
+def summarize(load, errors, misses):
+    summary = {"load_processes": load, "trials": len(errors) + misses, "missed": misses}
+    if errors:
+        summary.update({
+            "mean_ms": statistics.mean(errors) * 1000,
+            "sd_ms": statistics.stdev(errors) * 1000 if len(errors) > 1 else 0.0,
+            "median_ms": statistics.median(errors) * 1000,
+            "p95_ms": percentile(errors, 0.95) * 1000,
+            "p99_ms": percentile(errors, 0.99) * 1000,
+            "max_ms": max(errors) * 1000,
+        })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure reaction-time recording error of the response loop.")
+    parser.add_argument("experiment", choices=["exp_1", "exp_2"])
+    parser.add_argument("--trials", type=int, default=TRIALS_PER_LEVEL, help="Trials per load level")
+    parser.add_argument("--loads", type=int, nargs="+", default=LOAD_LEVELS, help="Background load levels")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the injected delays")
+    parser.add_argument("--output", default="latency_report.csv", help="Summary report CSV")
+    parser.add_argument("--raw", default=None, help="Also save every measured error to this CSV")
+    args = parser.parse_args()
+
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import importlib
+    import pygame
+    import timing
+    experiment = importlib.import_module(args.experiment)
+    experiment.init_display()
+    experiment.RESPONSE_WINDOW = max(experiment.RESPONSE_WINDOW, INJECT_MAX + 0.5)
+
+    rng = random.Random(args.seed)
+    report = []
+    raw = []
+    for load in args.loads:
+        workers = start_load(load)
+        try:
+            errors, misses = measure_errors(experiment, pygame, timing, args.trials, rng)
+        finally:
+            stop_load(workers)
+        summary = summarize(load, errors, misses)
+        report.append(summary)
+        raw.extend((load, error) for error in errors)
+        if errors:
+            print(f"load {load}: mean {summary['mean_ms']:.3f} ms, sd {summary['sd_ms']:.3f} ms, "
+                  f"p99 {summary['p99_ms']:.3f} ms, max {summary['max_ms']:.3f} ms, missed {misses}")
+        else:
+            print(f"load {load}: every one of the {misses} trials was missed")
+
+    with open(args.output, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(report)
+    if args.raw:
+        with open(args.raw, mode="w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["load_processes", "error_seconds"])
+            writer.writerows(raw)
+    print(f"Report saved to {args.output}")
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
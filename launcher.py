@@ -0,0 +1,51 @@
+import time
+
+LAUNCH_TIME = time.perf_counter()
+
+import argparse
+import importlib
+import os
+
+# ===============================
+# Experiment Launcher
+# ===============================
+# Starts one of the experiment scripts with only the pygame modules it needs
+# (display, which includes events, and font) and reports how long it took to
+# get the first screen up.
+#
+# Usage:
+#   python launcher.py exp_1
+#   python launcher.py exp_2_try
+
+EXPERIMENTS = ["exp_1_try", "exp_1", "exp_2_try", "exp_2"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start an experiment and report its startup time.")
+    parser.add_argument("experiment", choices=EXPERIMENTS)
+    args = parser.parse_args()
+
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import pygame
+    import timing
+
+    experiment = importlib.import_module(args.experiment)
+    imported = time.perf_counter()
+    experiment.init_display()
+    window_open = time.perf_counter()
+
+    # Report startup time once the first screen has been flipped
+    def report_first_screen(label, flip_time):
+        timing.remove_flip_listener(report_first_screen)
+        first_screen = time.perf_counter()
+        print(f"Startup: imports {(imported - LAUNCH_TIME) * 1000:.0f} ms, "
+              f"window {(window_open - imported) * 1000:.0f} ms, "
+              f"first screen {(first_screen - LAUNCH_TIME) * 1000:.0f} ms")
+
+    timing.add_flip_listener(report_first_screen)
+    experiment.main()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import csv
+import os
+import socket
+import struct
+import time
+
+import timing
+from running_stats import RunningStats
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Where markers go by default: (host, port) for UDP, or a file path for a
+# local (Unix datagram) socket
+MARKER_ADDRESS = ("127.0.0.1", 47002)
+
+# Trigger codes (one byte, as most EEG/physiology amplifiers take them)
+FIXATION_CODE = 1
+DISTRACTOR_CODE = 2
+STIMULUS_BASE_CODE = 10       # Stimulus onset: 10 + condition index
+RESPONSE_CORRECT_CODE = 100
+RESPONSE_INCORRECT_CODE = 101
+NO_RESPONSE_CODE = 102
+
+# ===============================
+# Event Marker Code
+# ===============================
+# The experiments arm a marker just before a flip; a flip listener (the first
+# one timing.flip() calls) sends it straight after the present. Every marker
+# name is mapped to its code when the output is opened, and every datagram is
+# packed into one preallocated buffer, so the send path does a struct
+# pack_into() and a non-blocking sendto() and nothing else. If no receiver is
+# listening the datagram is dropped; the trial loop never waits.
+#
+# Datagram: sequence number (uint32), code (uint8), event time (the flip, or
+# the keypress for responses) and send time (float64, seconds on the
+# time.perf_counter() clock, which all processes on one machine share).
+# The marker log keeps the same fields plus the marker name and trial index,
+# and is written next to the results when the block ends.
+#
+# To check timing and loss without an amplifier, run a local receiver:
+#   python markers.py
+#   python markers.py --socket /tmp/markers.sock
+
+PACKET = struct.Struct("<IBdd")
+
+LOG_FIELDS = ["sequence", "code", "marker", "trial", "event_time", "send_time"]
+
+
+# Datagram socket for a (host, port) UDP address or a Unix socket path
+def open_socket(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    return socket.socket(family, socket.SOCK_DGRAM)
+
+
+# Marker name -> code for the given stimulus conditions
+def marker_codes(conditions):
+    codes = {
+        "fixation": FIXATION_CODE,
+        "distractor": DISTRACTOR_CODE,
+        "response/correct": RESPONSE_CORRECT_CODE,
+        "response/incorrect": RESPONSE_INCORRECT_CODE,
+        "response/none": NO_RESPONSE_CODE,
+    }
+    for i, condition in enumerate(conditions):
+        code = STIMULUS_BASE_CODE + i
+        if code >= RESPONSE_CORRECT_CODE:
+            raise ValueError(f"Too many conditions for the stimulus code range: {len(conditions)}")
+        codes[f"stimulus/{condition}"] = code
+    return codes
+
+
+class MarkerOutput:
+    def __init__(self, address, conditions, log_file=None):
+        self.address = address
+        self.codes = marker_codes(conditions)
+        self.log_file = log_file
+        self.sock = open_socket(address)
+        self.sock.setblocking(False)
+        self._buffer = bytearray(PACKET.size)
+        self._sequence = 0
+        self._armed = None
+        self._log = []
+        timing.add_flip_listener(self.on_flip, first=True)
+
+    # Send the named marker with the next flip
+    def arm(self, marker, trial_index=None):
+        self._armed = (marker, self.codes[marker], trial_index)
+
+    def on_flip(self, label, flip_time):
+        if self._armed is not None:
+            marker, code, trial_index = self._armed
+            self._armed = None
+            self._send(marker, code, trial_index, flip_time)
+
+    # Send a marker that is not tied to a flip (e.g. a response) right away
+    def send(self, marker, trial_index=None, event_time=None):
+        self._send(marker, self.codes[marker], trial_index, timing.now() if event_time is None else event_time)
+
+    # Response marker, timed at the keypress (or the end of the response window)
+    def send_response(self, trial_index, start_time, correct, reaction_time):
+        if reaction_time is None:
+            self.send("response/none", trial_index)
+        else:
+            marker = "response/correct" if correct else "response/incorrect"
+            self.send(marker, trial_index, start_time + reaction_time)
+
+    def _send(self, marker, code, trial_index, event_time):
+        self._sequence += 1
+        send_time = time.perf_counter()
+        PACKET.pack_into(self._buffer, 0, self._sequence, code, event_time, send_time)
+        try:
+            self.sock.sendto(self._buffer, self.address)
+        except OSError:
+            pass  # No receiver or buffer full: the trial loop must not wait
+        self._log.append((self._sequence, code, marker, trial_index, event_time, send_time))
+
+    def close(self):
+        timing.remove_flip_listener(self.on_flip)
+        self.sock.close()
+        if self.log_file:
+            with open(self.log_file, mode="w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(LOG_FIELDS)
+                writer.writerows(self._log)
+
+
+# Open a marker output, or return None when markers are disabled (address is None)
+def open_output(address, conditions, log_file=None):
+    return MarkerOutput(address, conditions, log_file) if address else None
+
+
+# Print every marker received and check the sequence for gaps. Delays are
+# event -> send (inside the experiment) and send -> receive (the socket).
+def listen(address):
+    sock = open_socket(address)
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+    sock.bind(address)
+    print(f"Listening for markers on {address}")
+
+    send_delay = RunningStats()
+    transport_delay = RunningStats()
+    expected = None
+    lost = 0
+    try:
+        while True:
+            data = sock.recv(PACKET.size)
+            received = time.perf_counter()
+            sequence, code, event_time, send_time = PACKET.unpack(data)
+            if sequence == 1:
+                expected = None   # A new block started
+            if expected is not None and sequence != expected:
+                lost += sequence - expected
+                print(f"  WARNING: {sequence - expected} marker(s) missing before {sequence}")
+            expected = sequence + 1
+            transport_delay.add(received - send_time)
+            if event_time <= send_time:   # Replays run on a virtual clock; skip those
+                send_delay.add(send_time - event_time)
+            print(f"marker {sequence}: code {code:3d}  event->send {(send_time - event_time) * 1000:7.3f} ms  "
+                  f"send->receive {(received - send_time) * 1000:7.3f} ms")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+    print(f"{transport_delay.n} markers received, {lost} missing")
+    if send_delay.n:
+        print(f"event->send   mean {send_delay.mean * 1000:.3f} ms, sd {send_delay.sd * 1000:.3f} ms")
+    if transport_delay.n:
+        print(f"send->receive mean {transport_delay.mean * 1000:.3f} ms, sd {transport_delay.sd * 1000:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in receiver that checks event markers from the experiments.")
+    parser.add_argument("--host", default=MARKER_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=MARKER_ADDRESS[1])
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket path instead of UDP")
+    args = parser.parse_args()
+    listen(args.socket or (args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
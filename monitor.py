@@ -0,0 +1,142 @@
+import argparse
+import json
+import socket
+
+from running_stats import RunningStats
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Address the experiments send trial events to and the monitor listens on
+MONITOR_ADDRESS = ("127.0.0.1", 47001)
+
+# Warn when the same key is pressed this many trials in a row
+STUCK_KEY_RUN = 8
+
+# Warn when accuracy over at least this many trials is at or below chance
+MIN_TRIALS_FOR_CHANCE_CHECK = 20
+
+# ===============================
+# Live Monitor Code
+# ===============================
+# exp_1 and exp_2 send one small JSON datagram per trial through a
+# non-blocking UDP socket; if no monitor is listening the datagrams are simply
+# dropped. Run the monitor in a second terminal on the experimenter's side:
+#
+#   python monitor.py
+#
+# It keeps accuracy, reaction time mean and variance (Welford) and the
+# no-response rate per condition, each updated in constant time per trial.
+
+
+# Sends one participant's trial events to the monitor without ever blocking
+# the trial loop
+class Publisher:
+    def __init__(self, address, experiment, participant, key_count):
+        self.address = address
+        self.session = {"experiment": experiment, "participant": participant, "key_count": key_count}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def send_trial(self, trial_index, condition, key, correct, reaction_time):
+        event = dict(self.session, trial=trial_index, condition=condition, key=key,
+                     correct=correct, reaction_time=reaction_time)
+        try:
+            self.sock.sendto(json.dumps(event).encode(), self.address)
+        except OSError:
+            pass  # Nobody listening or buffer full: the trial loop must not wait
+
+    def close(self):
+        self.sock.close()
+
+
+# Open a publisher, or return None when monitoring is disabled (address is None)
+def open_publisher(address, experiment, participant, key_count):
+    return Publisher(address, experiment, participant, key_count) if address else None
+
+
+class ConditionStats:
+    def __init__(self):
+        self.trials = 0
+        self.correct = 0
+        self.no_response = 0
+        self.rt = RunningStats()
+
+    def add(self, event):
+        self.trials += 1
+        self.correct += bool(event["correct"])
+        if event["reaction_time"] is None:
+            self.no_response += 1
+        else:
+            self.rt.add(event["reaction_time"])
+
+
+# Per-participant state kept by the monitor
+class SessionStats:
+    def __init__(self, key_count):
+        self.conditions = {}
+        self.overall = ConditionStats()
+        self.key_count = key_count
+        self.last_key = None
+        self.key_run = 0
+
+    def add(self, event):
+        self.conditions.setdefault(event["condition"], ConditionStats()).add(event)
+        self.overall.add(event)
+        if event["key"] is not None and event["key"] == self.last_key:
+            self.key_run += 1
+        else:
+            self.key_run = 1 if event["key"] is not None else 0
+        self.last_key = event["key"]
+
+    def warnings(self):
+        found = []
+        if self.key_run >= STUCK_KEY_RUN:
+            found.append(f"same key {self.key_run} trials in a row")
+        if self.overall.trials >= MIN_TRIALS_FOR_CHANCE_CHECK and self.key_count:
+            if self.overall.correct / self.overall.trials <= 1 / self.key_count:
+                found.append("accuracy at chance level")
+        return found
+
+
+def format_condition(name, stats):
+    accuracy = stats.correct / stats.trials * 100
+    no_response = stats.no_response / stats.trials * 100
+    return (f"  {name:<10} n={stats.trials:<4} acc={accuracy:5.1f}%  "
+            f"RT={stats.rt.mean * 1000:6.0f} ± {stats.rt.sd * 1000:4.0f} ms  no-resp={no_response:4.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show live per-condition statistics from running experiments.")
+    parser.add_argument("--host", default=MONITOR_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=MONITOR_ADDRESS[1])
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((args.host, args.port))
+    print(f"Listening for trial events on {args.host}:{args.port}")
+
+    sessions = {}
+    while True:
+        data, _ = sock.recvfrom(65536)
+        event = json.loads(data)
+        session_key = (event["experiment"], event["participant"])
+        session = sessions.get(session_key)
+        if session is None:
+            session = sessions[session_key] = SessionStats(event.get("key_count"))
+        session.add(event)
+
+        outcome = "no response" if event["reaction_time"] is None else (
+            f"{'correct' if event['correct'] else 'incorrect'} {event['reaction_time'] * 1000:.0f} ms"
+        )
+        print(f"{event['experiment']} {event['participant']} trial {event['trial'] + 1}: "
+              f"{event['condition']} {outcome}")
+        for name, stats in sorted(session.conditions.items()):
+            print(format_condition(name, stats))
+        for warning in session.warnings():
+            print(f"  WARNING: {warning}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import csv
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import stats
+
+import schedules
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Conditions, as used by the experiments
+EXP1_STIMULI_PATHS = {
+    "happy": "distractors/happy",
+    "neutral": "distractors/neutral",
+    "angry": "distractors/angry"
+}
+EXP1_STIMULI_PER_EMOTION = 140   # Used when the stimulus folders are not available
+EXP2_SHAPES = ["circle", "square", "triangle"]
+EXP2_DISTRACTORS = ["happy", "angry", "neutral"]
+
+# Generative model for synthetic participants (times in seconds)
+BASE_RT = 0.60                   # Mean reaction time
+RT_TRIAL_SD = 0.15               # Trial-to-trial RT noise
+RT_PARTICIPANT_SD = 0.08         # Spread of participants' mean RT
+EFFECT_PARTICIPANT_SD = 0.02     # Spread of the effect across participants
+BASE_ACCURACY = 0.92             # Probability of a correct response
+
+# Planned analysis
+ALPHA = 0.05                     # Two-sided significance level
+
+# Simulation grid
+TRIAL_COUNTS = [50, 100, 150, 200, 300]   # Values of TOTAL_TRIALS to simulate
+SAMPLE_SIZES = [10, 20, 30, 40, 60]       # Numbers of participants to simulate
+N_SIMULATIONS = 2000                      # Simulated experiments per grid cell
+CHUNK_SIZE = 250                          # Simulated experiments per worker job
+
+# ===============================
+# Simulation Code
+# ===============================
+# Each simulated participant gets a trial schedule from the same code the
+# experiments use (schedules.py). Reaction times and accuracy are then drawn
+# for all simulated experiments of a chunk at once as NumPy arrays, and the
+# planned analysis (paired t-test of target vs reference condition across
+# participants, on mean correct RT and on accuracy) is run on every simulated
+# experiment. Chunks are spread over a process pool.
+
+CONDITIONS = {"exp_1": list(EXP1_STIMULI_PATHS), "exp_2": EXP2_DISTRACTORS}
+
+
+# The exp_1 stimulus pool, one entry per face image
+def exp1_pool():
+    pool = []
+    for emotion, folder in EXP1_STIMULI_PATHS.items():
+        count = len(os.listdir(folder)) if os.path.isdir(folder) else EXP1_STIMULI_PER_EMOTION
+        pool.extend({"emotion": emotion} for _ in range(count))
+    return pool
+
+
+# Condition label of every trial in one participant's schedule
+def schedule_conditions(experiment, total_trials, rng, pool=None):
+    if experiment == "exp_1":
+        return [trial["emotion"] for trial in schedules.sample_stimuli(pool, total_trials, rng)]
+    trials = schedules.generate_trials(EXP2_SHAPES, EXP2_DISTRACTORS, total_trials, rng)
+    return [trial["distractor_type"] for trial in trials]
+
+
+# Mean over the trial axis of the entries selected by mask (NaN where none are)
+def masked_mean(values, mask):
+    counts = mask.sum(axis=-1)
+    totals = np.where(mask, values, 0.0).sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+# Two-sided one-sample t-test of every row of differences against zero
+def significant(differences):
+    n = np.sum(~np.isnan(differences), axis=-1)
+    mean = np.nanmean(differences, axis=-1)
+    sd = np.nanstd(differences, axis=-1, ddof=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = mean / (sd / np.sqrt(n))
+    critical = stats.t.ppf(1 - ALPHA / 2, np.maximum(n - 1, 1))
+    return (n > 1) & (np.abs(t) > critical)
+
+
+# Simulate one chunk of experiments and count the significant results
+def simulate_chunk(job):
+    experiment, total_trials, participants, simulations, effect, accuracy_effect, target, reference, seed = job
+    py_rng = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    pool = exp1_pool() if experiment == "exp_1" else None
+
+    codes = {condition: i for i, condition in enumerate(CONDITIONS[experiment])}
+    conditions = np.array([
+        [codes[condition] for condition in schedule_conditions(experiment, total_trials, py_rng, pool)]
+        for _ in range(simulations * participants)
+    ], dtype=np.int8).reshape(simulations, participants, -1)
+    is_target = conditions == codes[target]
+    is_reference = conditions == codes[reference]
+
+    intercepts = rng.normal(0.0, RT_PARTICIPANT_SD, (simulations, participants, 1))
+    slopes = effect + rng.normal(0.0, EFFECT_PARTICIPANT_SD, (simulations, participants, 1))
+    rts = BASE_RT + intercepts + slopes * is_target + rng.normal(0.0, RT_TRIAL_SD, conditions.shape)
+    p_correct = np.clip(BASE_ACCURACY + accuracy_effect * is_target, 0.0, 1.0)
+    correct = rng.random(conditions.shape) < p_correct
+
+    rt_differences = masked_mean(rts, is_target & correct) - masked_mean(rts, is_reference & correct)
+    accuracy_differences = masked_mean(correct, is_target) - masked_mean(correct, is_reference)
+    return (experiment, total_trials, participants,
+            int(significant(rt_differences).sum()), int(significant(accuracy_differences).sum()), simulations)
+
+
+# Estimate power for every (total_trials, participants) cell of the grid
+def power_curves(experiment, effect, accuracy_effect, target, reference,
+                 trial_counts=TRIAL_COUNTS, sample_sizes=SAMPLE_SIZES,
+                 simulations=N_SIMULATIONS, workers=None, seed=None):
+    jobs = []
+    for total_trials in trial_counts:
+        for participants in sample_sizes:
+            for start in range(0, simulations, CHUNK_SIZE):
+                jobs.append([experiment, total_trials, participants, min(CHUNK_SIZE, simulations - start),
+                             effect, accuracy_effect, target, reference])
+    seeds = np.random.SeedSequence(seed).spawn(len(jobs))
+    jobs = [tuple(job) + (int(s.generate_state(1)[0]),) for job, s in zip(jobs, seeds)]
+
+    counts = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for experiment, total_trials, participants, rt_hits, accuracy_hits, runs in pool.map(simulate_chunk, jobs):
+            cell = counts.setdefault((total_trials, participants), [0, 0, 0])
+            cell[0] += rt_hits
+            cell[1] += accuracy_hits
+            cell[2] += runs
+
+    return [
+        {
+            "experiment": experiment,
+            "total_trials": total_trials,
+            "participants": participants,
+            "rt_power": rt_hits / runs,
+            "accuracy_power": accuracy_hits / runs,
+            "simulations": runs,
+        }
+        for (total_trials, participants), (rt_hits, accuracy_hits, runs) in sorted(counts.items())
+    ]
+
+
+def save_power_curves(filename, rows):
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_power_table(rows, measure):
+    sample_sizes = sorted({row["participants"] for row in rows})
+    print(f"{measure} by TOTAL_TRIALS (rows) and participants (columns)")
+    print(f"{'':>8}" + "".join(f"{n:>8}" for n in sample_sizes))
+    for total_trials in sorted({row["total_trials"] for row in rows}):
+        cells = {row["participants"]: row[measure] for row in rows if row["total_trials"] == total_trials}
+        print(f"{total_trials:>8}" + "".join(f"{cells[n]:>8.2f}" for n in sample_sizes))
+
+
+def plot_power_curves(filename, rows, measure):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(6, 4))
+    for participants in sorted({row["participants"] for row in rows}):
+        cell_rows = [row for row in rows if row["participants"] == participants]
+        ax.plot([row["total_trials"] for row in cell_rows], [row[measure] for row in cell_rows],
+                marker="o", label=f"{participants} participants")
+    ax.axhline(0.8, color="grey", linestyle="--", linewidth=1)
+    ax.set_xlabel("TOTAL_TRIALS")
+    ax.set_ylabel("Power")
+    ax.set_ylim(0, 1)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo power analysis for exp_1 and exp_2.")
+    parser.add_argument("experiment", choices=["exp_1", "exp_2"])
+    parser.add_argument("--effect", type=float, default=0.02, help="RT effect of the target condition (seconds)")
+    parser.add_argument("--accuracy-effect", type=float, default=0.0, help="Accuracy effect of the target condition")
+    parser.add_argument("--target", default="angry", help="Condition with the effect")
+    parser.add_argument("--reference", help="Condition it is compared with (default: happy for exp_1, neutral for exp_2)")
+    parser.add_argument("--trials", type=int, nargs="+", default=TRIAL_COUNTS, help="TOTAL_TRIALS values")
+    parser.add_argument("--participants", type=int, nargs="+", default=SAMPLE_SIZES, help="Sample sizes")
+    parser.add_argument("--simulations", type=int, default=N_SIMULATIONS, help="Simulated experiments per cell")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--output", default=None, help="CSV file for the power curves")
+    parser.add_argument("--plot", default=None, help="Save a plot of the RT power curves to this file")
+    args = parser.parse_args()
+
+    reference = args.reference or ("happy" if args.experiment == "exp_1" else "neutral")
+    for condition in (args.target, reference):
+        if condition not in CONDITIONS[args.experiment]:
+            parser.error(f"unknown condition for {args.experiment}: {condition}")
+
+    rows = power_curves(args.experiment, args.effect, args.accuracy_effect, args.target, reference,
+                        args.trials, args.participants, args.simulations, args.workers, args.seed)
+
+    print_power_table(rows, "rt_power")
+    if args.accuracy_effect:
+        print_power_table(rows, "accuracy_power")
+    save_power_curves(args.output or f"{args.experiment}_power_curves.csv", rows)
+    if args.plot:
+        plot_power_curves(args.plot, rows, "rt_power")
+
+
+if __name__ == "__main__":
+    main()
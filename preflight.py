@@ -0,0 +1,225 @@
+import csv
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+
+import pygame
+
+import timing
+from running_stats import percentile
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Measurements are appended to this CSV in the results folder, one row per check
+PREFLIGHT_LOG = "preflight_log.csv"
+
+# Sample sizes
+FLIP_SAMPLES = 120            # Display flips (about 2 seconds at 60 Hz)
+DECODE_SAMPLES = 20           # Images decoded per stimulus source
+WRITE_SAMPLES = 20            # Small appends to a file in the results folder
+WAKE_SAMPLES = 30             # Events posted to the response loop
+
+# Largest acceptable delay between an event being posted and the response
+# loop seeing it (seconds); this bounds the reaction time error
+MAX_RT_ERROR = 0.002
+
+# How far (seconds) a phase duration may be from a whole number of frames
+FRAME_GRID_TOLERANCE = 0.001
+
+# ===============================
+# Preflight Code
+# ===============================
+# Measures the station before the participant form appears:
+#   frame_ms / flip_jitter_ms  median flip interval and how far the 99th
+#                              percentile lies above it (refresh_hz = 1 / median).
+#                              Only measured when flips wait for vsync (see
+#                              render_backend.py); otherwise left empty and
+#                              not checked.
+#   decode_ms                  95th percentile decode + resize time per trial,
+#                              summed over the images a trial shows, sampled
+#                              from the files the experiment loads (the
+#                              preprocessed faces when it uses them)
+#   write_ms / fsync_ms        99th percentile append + flush (what the trial
+#                              journal does) and fsync in the results folder,
+#                              for information: the journal is written after
+#                              the response window, outside any timed phase
+#   wake_ms                    99th percentile delay until a posted event is
+#                              seen by a loop polling like collect_response()
+# and compares them with the budget of the experiment's settings:
+#   - with vsync, the flip jitter must stay under half a frame (the trial
+#     loop counts anything more as a missed refresh), and every timed phase
+#     (FIXATION_TIME, DISTRACTOR_ONLY_TIME, RESPONSE_WINDOW) must be a whole
+#     number of frames at the measured refresh rate
+#   - a trial's images are loaded during the fixation phase, so decode_ms
+#     must fit in the wait before the stimulus flip (timing.phase_budget())
+#   - wake_ms must stay under MAX_RT_ERROR
+# The experiments call run() from main() with their PREFLIGHT setting:
+# "warn" prints the problems and goes on, "refuse" does not start the
+# session.
+
+
+# Median flip interval and its 99th percentile, in seconds
+def measure_flips(screen):
+    flip_times = []
+    for _ in range(FLIP_SAMPLES + 1):
+        screen.fill((255, 255, 255))
+        flip_times.append(timing.flip("preflight"))
+    intervals = [later - earlier for earlier, later in zip(flip_times, flip_times[1:])]
+    return statistics.median(intervals), percentile(intervals, 0.99)
+
+
+# Decode times of a sample of the images at paths, done the way
+# image_cache.load() does it but without caching
+def measure_decodes(paths, size):
+    durations = []
+    for path in random.sample(paths, min(DECODE_SAMPLES, len(paths))):
+        start = time.perf_counter()
+        img = pygame.image.load(path)
+        if img.get_size() != size:
+            img = pygame.transform.scale(img, size)
+        if pygame.display.get_surface() is not None:
+            img.convert()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# 99th percentile append + flush and fsync times in folder
+def measure_writes(folder):
+    filename = os.path.join(folder, f".preflight_{os.getpid()}.tmp")
+    writes = []
+    syncs = []
+    try:
+        with open(filename, mode="a") as file:
+            for i in range(WRITE_SAMPLES):
+                start = time.perf_counter()
+                file.write(f'{{"type": "trial", "trial_index": {i}, "reaction_time": 0.5}}\n')
+                file.flush()
+                flushed = time.perf_counter()
+                os.fsync(file.fileno())
+                writes.append(flushed - start)
+                syncs.append(time.perf_counter() - flushed)
+    finally:
+        os.remove(filename)
+    return percentile(writes, 0.99), percentile(syncs, 0.99)
+
+
+def post_event(due_time, posted):
+    time.sleep(max(due_time - time.perf_counter(), 0.0))
+    posted.append(time.perf_counter())
+    pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+
+
+# 99th percentile delay between posting an event and a polling loop seeing it
+def measure_wake_ups():
+    delays = []
+    for _ in range(WAKE_SAMPLES):
+        pygame.event.clear()
+        posted = []
+        poster = threading.Thread(target=post_event, args=(time.perf_counter() + random.uniform(0.005, 0.02), posted))
+        poster.start()
+        deadline = time.perf_counter() + 1.0
+        seen = None
+        while seen is None and time.perf_counter() < deadline:
+            for event in timing.get_events():
+                if event.type == pygame.USEREVENT:
+                    seen = time.perf_counter()
+        poster.join()
+        if seen is not None:
+            delays.append(seen - posted[0])
+    pygame.event.clear()
+    return percentile(delays, 0.99) if delays else float("inf")
+
+
+# Measure the station. sources lists, for every image a trial shows, the
+# image files it is drawn from and the size it is shown at. The flip values
+# are None when flips are not vsync'd.
+def measure(screen, sources, results_folder="."):
+    refresh_hz = frame_ms = flip_jitter_ms = None
+    if timing.frame_duration() > 0:
+        frame, flip_p99 = measure_flips(screen)
+        refresh_hz = 1 / frame
+        frame_ms = frame * 1000
+        flip_jitter_ms = (flip_p99 - frame) * 1000
+    decodes = [measure_decodes(paths, size) for paths, size in sources]
+    decoded = [duration for durations in decodes for duration in durations]
+    write, fsync = measure_writes(results_folder)
+    return {
+        "refresh_hz": refresh_hz,
+        "frame_ms": frame_ms,
+        "flip_jitter_ms": flip_jitter_ms,
+        "decode_ms": sum(percentile(durations, 0.95) for durations in decodes if durations) * 1000,
+        "decode_per_s": len(decoded) / sum(decoded) if decoded else 0.0,
+        "write_ms": write * 1000,
+        "fsync_ms": fsync * 1000,
+        "wake_ms": measure_wake_ups() * 1000,
+    }
+
+
+# Problems with the measurements for the given settings (empty if none).
+# budget holds the phase durations in seconds; the images of a trial are
+# loaded during its FIXATION_TIME.
+def check(measurements, budget):
+    problems = []
+    frame_ms = measurements["frame_ms"]
+    if frame_ms is not None:
+        if measurements["flip_jitter_ms"] > frame_ms / 2:
+            problems.append(f"flips run up to {measurements['flip_jitter_ms']:.1f} ms late, so refreshes are missed")
+        for phase in ("FIXATION_TIME", "DISTRACTOR_ONLY_TIME", "RESPONSE_WINDOW"):
+            if phase not in budget:
+                continue
+            frames = max(round(budget[phase] * 1000 / frame_ms), 1)
+            if abs(frames * frame_ms - budget[phase] * 1000) > FRAME_GRID_TOLERANCE * 1000:
+                problems.append(f"{phase} is not a whole number of frames at {measurements['refresh_hz']:.2f} Hz; "
+                                f"it will last {frames} frames ({frames * frame_ms:.1f} ms)")
+    load_budget_ms = timing.phase_budget(budget["FIXATION_TIME"]) * 1000
+    if measurements["decode_ms"] > load_budget_ms:
+        problems.append(f"loading a trial's images takes {measurements['decode_ms']:.1f} ms, more than the "
+                        f"{load_budget_ms:.1f} ms the fixation phase leaves; stimulus flips would be late")
+    if measurements["wake_ms"] > MAX_RT_ERROR * 1000:
+        problems.append(f"key presses are seen up to {measurements['wake_ms']:.1f} ms late")
+    return problems
+
+
+def save(filename, label, measurements, problems):
+    row = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "station": socket.gethostname(),
+        "experiment": label,
+        **{name: "" if value is None else f"{value:.3f}" for name, value in measurements.items()},
+        "problems": "; ".join(problems),
+    }
+    is_first_write = not os.path.exists(filename)
+    with open(filename, mode="a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(row))
+        if is_first_write:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+# Measure and check the station for one experiment. Returns False when the
+# session must not start (mode "refuse" and the budget cannot be met).
+def run(label, screen, budget, sources, mode="warn", results_folder="."):
+    if not mode:
+        return True
+    measurements = measure(screen, sources, results_folder)
+    problems = check(measurements, budget)
+    save(os.path.join(results_folder, PREFLIGHT_LOG), label, measurements, problems)
+
+    if measurements["refresh_hz"] is None:
+        display = "refresh rate not measured (flips are not vsync'd)"
+    else:
+        display = f"{measurements['refresh_hz']:.1f} Hz, flip jitter {measurements['flip_jitter_ms']:.2f} ms"
+    print(f"{label} preflight: {display}, "
+          f"decode {measurements['decode_ms']:.2f} ms/trial ({measurements['decode_per_s']:.0f} images/s), "
+          f"write {measurements['write_ms']:.2f} ms, wake-up {measurements['wake_ms']:.2f} ms")
+    for problem in problems:
+        print(f"  WARNING: {problem}")
+    if problems and mode == "refuse":
+        print(f"{label}: this station cannot keep the timing budget, not starting (PREFLIGHT = \"refuse\")")
+        return False
+    return True
@@ -0,0 +1,182 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageEnhance, ImageStat
+except ImportError:  # Pillow is only needed to build the cache, not to read it
+    Image = None
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Face folders to preprocess
+SOURCE_FOLDERS = {
+    "happy": "distractors/happy",
+    "neutral": "distractors/neutral",
+    "angry": "distractors/angry",
+    "sad": "distractors/sad"
+}
+
+# Where preprocessed faces are written
+CACHE_ROOT = "face_cache"
+
+# Bump when the processing steps change so old caches are not reused
+PIPELINE_VERSION = 2
+
+# Output size in pixels (square), matching the size the experiments display faces at
+TARGET_SIZE = 400
+
+# Face region as fractions of the source image (left, top, right, bottom).
+# KDEF frames are 562x762 with the face centred slightly above the middle;
+# this crop is close to square so resizing keeps the aspect ratio.
+FACE_BOX = (0.05, 0.17, 0.95, 0.83)
+
+# Mean luminance (0-255) that faces are scaled to when equalizing
+TARGET_LUMINANCE = 128
+
+# ===============================
+# Preprocessing Code
+# ===============================
+# Each build writes to face_cache/v<version>-<params>/ so different settings
+# never overwrite each other, and outputs are named after the source file and
+# its content hash so edited sources are picked up. The last build is recorded
+# in face_cache/current.json, which is what the experiments read.
+#
+# Faces are stored as uncompressed BMP: pygame decodes a 400x400 BMP in well
+# under a millisecond, while the same face as PNG takes longer to decode than
+# the original JPEG plus resizing, and trials load faces while they run.
+
+
+def pipeline_params(size=TARGET_SIZE, face_box=FACE_BOX, equalize=False, grayscale=False):
+    return {
+        "version": PIPELINE_VERSION,
+        "size": size,
+        "face_box": list(face_box),
+        "equalize": equalize,
+        "target_luminance": TARGET_LUMINANCE if equalize else None,
+        "grayscale": grayscale,
+    }
+
+
+def cache_dir(params):
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:10]
+    return os.path.join(CACHE_ROOT, f"v{params['version']}-{key}")
+
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+# Crop, resample and adjust one face (runs in a worker process)
+def process_face(job):
+    source, output, params = job
+    img = Image.open(source).convert("RGB")
+
+    width, height = img.size
+    left, top, right, bottom = params["face_box"]
+    img = img.crop((round(left * width), round(top * height), round(right * width), round(bottom * height)))
+    img = img.resize((params["size"], params["size"]), Image.LANCZOS)
+
+    if params["grayscale"]:
+        img = img.convert("L")
+    if params["equalize"]:
+        mean_luminance = ImageStat.Stat(img.convert("L")).mean[0]
+        if mean_luminance > 0:
+            img = ImageEnhance.Brightness(img).enhance(params["target_luminance"] / mean_luminance)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    img.save(output)
+    return output
+
+
+# Preprocess every face that is not already cached and return the manifest
+def build_cache(params, folders=SOURCE_FOLDERS, workers=None, force=False):
+    if Image is None:
+        raise ImportError("Pillow is required to preprocess faces (pip install pillow)")
+
+    output_dir = cache_dir(params)
+    manifest = {"params": params, "faces": {}}
+    jobs = []
+    for emotion, folder in folders.items():
+        for img_file in sorted(os.listdir(folder)):
+            if not img_file.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            source = os.path.join(folder, img_file)
+            digest = file_hash(source)
+            stem = os.path.splitext(img_file)[0]
+            output = os.path.join(output_dir, emotion, f"{stem}-{digest[:12]}.bmp")
+            stat = os.stat(source)
+            manifest["faces"][source] = {
+                "hash": digest,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "output": output,
+            }
+            if force or not os.path.exists(output):
+                jobs.append((source, output, params))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(process_face, jobs, chunksize=8):
+                pass
+    print(f"Preprocessed {len(jobs)} faces ({len(manifest['faces']) - len(jobs)} already cached) in {output_dir}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=1)
+    return manifest
+
+
+# Make a built cache the one the experiments load
+def activate(params):
+    os.makedirs(CACHE_ROOT, exist_ok=True)
+    with open(os.path.join(CACHE_ROOT, "current.json"), "w") as file:
+        json.dump({"cache_dir": cache_dir(params)}, file)
+
+
+# Map source face paths to their preprocessed versions in the active cache.
+# Sources that changed since the cache was built are left out, so callers fall
+# back to the original file.
+def load_face_paths():
+    try:
+        with open(os.path.join(CACHE_ROOT, "current.json")) as file:
+            current = json.load(file)
+        with open(os.path.join(current["cache_dir"], "manifest.json")) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError, KeyError):
+        return {}
+
+    face_paths = {}
+    for source, entry in manifest["faces"].items():
+        try:
+            stat = os.stat(source)
+        except OSError:
+            continue
+        if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"] and os.path.exists(entry["output"]):
+            face_paths[source] = entry["output"]
+    return face_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop and resample the KDEF faces for the experiments.")
+    parser.add_argument("--size", type=int, default=TARGET_SIZE, help="Output size in pixels")
+    parser.add_argument("--equalize", action="store_true", help="Scale every face to the same mean luminance")
+    parser.add_argument("--grayscale", action="store_true", help="Convert faces to grayscale")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--force", action="store_true", help="Reprocess faces that are already cached")
+    parser.add_argument("--no-activate", action="store_true", help="Build the cache without making the experiments use it")
+    args = parser.parse_args()
+
+    params = pipeline_params(args.size, FACE_BOX, args.equalize, args.grayscale)
+    build_cache(params, workers=args.workers, force=args.force)
+    if not args.no_activate:
+        activate(params)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import functools
+import statistics
+import time
+import weakref
+
+import pygame
+
+import timing
+
+try:
+    from pygame._sdl2 import video
+except ImportError:  # pygame builds without the SDL2 video wrappers can only use surfaces
+    video = None
+
+# ===============================
+# Rendering Backends
+# ===============================
+# "surface": the experiments draw with Surface.fill()/blit() into the
+#   display.set_mode() surface and timing.flip() calls display.flip(), which
+#   copies the whole frame in software.
+# "texture": the window gets an SDL2 Renderer (pygame._sdl2.video). Every
+#   image and text surface is uploaded once as a Texture and each frame is
+#   composited by the renderer and presented, tied to vsync when the renderer
+#   is accelerated. TextureScreen offers the fill()/blit() calls the
+#   experiments already use, so their drawing code is the same for both.
+#   If no accelerated renderer is available (e.g. on headless Linux with
+#   SDL_VIDEODRIVER=dummy) SDL's software renderer is used, and if that
+#   fails too, the "surface" backend. Only the accelerated renderer waits for
+#   vsync; its refresh interval is passed on to timing.set_present().
+
+BACKENDS = ("surface", "texture")
+
+TEXT_CACHE_SIZE = 256         # Rendered text surfaces kept per font
+
+FRAME_SAMPLES = 30            # Presents timed to find the refresh interval of a vsync'd renderer
+
+
+# Surface-like drawing target backed by an SDL2 Renderer
+class TextureScreen:
+    def __init__(self, window, renderer, vsync=False):
+        self.window = window
+        self.renderer = renderer
+        self.frame_duration = self._measure_frame() if vsync else 0.0
+        self._textures = weakref.WeakKeyDictionary()   # Surface -> Texture, dropped with the surface
+
+    def get_size(self):
+        return self.window.size
+
+    # Texture for a surface, uploaded on first use
+    def texture(self, surface):
+        texture = self._textures.get(surface)
+        if texture is None:
+            texture = video.Texture.from_surface(self.renderer, surface)
+            self._textures[surface] = texture
+        return texture
+
+    def fill(self, color):
+        self.renderer.draw_color = pygame.Color(color)
+        self.renderer.clear()
+
+    def blit(self, source, dest):
+        self.texture(source).draw(dstrect=pygame.Rect(dest[:2], source.get_size()))
+
+    def present(self):
+        self.renderer.present()
+
+    # Refresh interval: the median time between presents, each of which waits for vsync
+    def _measure_frame(self):
+        present_times = []
+        for _ in range(FRAME_SAMPLES + 1):
+            self.renderer.clear()
+            self.renderer.present()
+            present_times.append(time.perf_counter())
+        return statistics.median(later - earlier for earlier, later in zip(present_times, present_times[1:]))
+
+
+# pygame Font whose render() results are cached, so the same text is not
+# rendered again (or uploaded again as a texture) on every trial
+class CachedFont:
+    def __init__(self, name, size):
+        self.font = pygame.font.Font(name, size)
+        self._render = functools.lru_cache(maxsize=TEXT_CACHE_SIZE)(self.font.render)
+
+    def render(self, text, antialias, color, background=None):
+        return self._render(text, antialias, tuple(color), None if background is None else tuple(background))
+
+    def __getattr__(self, name):
+        return getattr(self.font, name)
+
+
+def _open_texture_screen(size, caption):
+    if video is None:
+        print("Texture backend needs pygame._sdl2, drawing with surfaces")
+        return None
+    window = video.Window(caption, size)
+    try:
+        renderer = video.Renderer(window, accelerated=1, vsync=True)
+    except RuntimeError as accelerated_error:   # pygame._sdl2 raises its own error type
+        try:
+            renderer = video.Renderer(window, accelerated=0)
+        except RuntimeError as software_error:
+            window.destroy()
+            print(f"Texture backend unavailable ({accelerated_error}; {software_error}), drawing with surfaces")
+            return None
+        print(f"No accelerated renderer ({accelerated_error}), using the SDL software renderer")
+        return TextureScreen(window, renderer)
+    return TextureScreen(window, renderer, vsync=True)
+
+
+# Open the experiment window and return the object to draw on. Must be called
+# after pygame.display.init(); also points timing.flip() at the right present.
+def open_window(size, caption, backend="surface"):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown render backend: {backend}")
+    if backend == "texture":
+        screen = _open_texture_screen(size, caption)
+        if screen is not None:
+            timing.set_present(screen.present, screen.frame_duration)
+            return screen
+
+    screen = pygame.display.set_mode(size)
+    pygame.display.set_caption(caption)
+    timing.set_present(pygame.display.flip)
+    return screen
+
+
+# Upload images ahead of time (no-op for the surface backend)
+def upload(screen, images):
+    if isinstance(screen, TextureScreen):
+        for img in images:
+            screen.texture(img)
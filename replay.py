@@ -0,0 +1,216 @@
+import argparse
+import csv
+import importlib
+import io
+import json
+import os
+import statistics
+import time
+
+import journal
+
+# ===============================
+# Session Replay
+# ===============================
+# Plays a recorded trial journal back through the real exp_1 / exp_2 trial
+# loop under SDL's dummy video driver. Keypresses are injected at the recorded
+# reaction times, so the replayed session should log the same outcomes as the
+# original one. The wall-clock time spent in each phase (fixation, distractor,
+# stimulus, feedback, ...) is measured so that changes to the trial loop can
+# be compared before and after.
+#
+# Usage:
+#   python replay.py alice_01_exp1_journal.jsonl            (real time)
+#   python replay.py alice_01_exp1_journal.jsonl --fast     (as fast as possible)
+#   python replay.py ... --timings after.csv --baseline before.csv
+
+RT_TOLERANCE_FAST = 1e-9      # Allowed RT difference with the virtual clock (seconds)
+RT_TOLERANCE_REALTIME = 0.005  # Allowed RT difference when replaying in real time (seconds)
+
+
+# Import an experiment module with the dummy video driver selected
+def load_experiment(name):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    return importlib.import_module(name)
+
+
+# Feeds the recorded keypresses back to the experiment and times each phase
+class Replayer:
+    def __init__(self, pygame, timing, recorded_trials, response_window, fast):
+        self.pygame = pygame
+        self.timing = timing
+        self.recorded_trials = recorded_trials
+        self.response_window = response_window
+        self.fast = fast
+        self.next_trial = 0
+        self.current = None                # Recorded entry of the trial being replayed
+        self.pending = None                # (due_time, key) of the next keypress to inject
+        self.phase_label = None
+        self.phase_start = None
+        self.phase_times = {}
+
+    def on_flip(self, label, flip_time):
+        wall_time = time.perf_counter()
+        if self.phase_label is not None:
+            self.phase_times.setdefault(self.phase_label, []).append(wall_time - self.phase_start)
+        self.phase_label = label
+        self.phase_start = wall_time
+
+        if label == "stimulus":
+            entry = self.recorded_trials[self.next_trial]
+            self.current = entry
+            self.next_trial += 1
+            if entry["key"] is not None:
+                self.pending = (flip_time + entry["reaction_time"], entry["key"])
+        elif label in ("instructions", "break"):
+            self.pending = (flip_time, self.pygame.K_SPACE)
+
+    # Lateness of the current trial as recorded, in place of timing.check_phases()
+    def check_phases(self, phases, end, tolerance):
+        return self.current.get("invalid")
+
+    def on_poll(self):
+        if self.fast:
+            if self.pending:
+                self.timing.advance(self.pending[0] - self.timing.now())
+            else:
+                self.timing.advance(self.response_window)
+        if self.pending and self.timing.now() >= self.pending[0]:
+            key = self.pending[1]
+            self.pending = None
+            self.pygame.event.post(self.pygame.event.Event(
+                self.pygame.KEYDOWN, key=key, mod=0, unicode="", scancode=0
+            ))
+
+    def finish(self):
+        self.on_flip(None, None)
+
+
+# Compare the replayed trials with the recorded ones and return the mismatches
+def compare_trials(recorded_trials, replayed_trials, rt_tolerance):
+    mismatches = []
+    if len(recorded_trials) != len(replayed_trials):
+        mismatches.append(f"trial count: recorded {len(recorded_trials)}, replayed {len(replayed_trials)}")
+    for recorded, replayed in zip(recorded_trials, replayed_trials):
+        index = recorded["trial_index"]
+        if recorded["trial"] != replayed["trial"]:
+            mismatches.append(f"trial {index}: stimulus {recorded['trial']} != {replayed['trial']}")
+        if recorded.get("invalid") != replayed.get("invalid"):
+            mismatches.append(f"trial {index}: late {recorded.get('invalid')} != {replayed.get('invalid')}")
+        if recorded["key"] != replayed["key"]:
+            mismatches.append(f"trial {index}: key {recorded['key']} != {replayed['key']}")
+        elif recorded["key"] is not None:
+            difference = abs(recorded["reaction_time"] - replayed["reaction_time"])
+            if difference > rt_tolerance:
+                mismatches.append(f"trial {index}: reaction time differs by {difference * 1000:.3f} ms")
+    return mismatches
+
+
+# Summarize phase durations as {phase: (count, mean, median, max)} in seconds
+def summarize_phases(phase_times):
+    summary = {}
+    for label, durations in phase_times.items():
+        summary[label] = (len(durations), statistics.mean(durations), statistics.median(durations), max(durations))
+    return summary
+
+
+def save_phase_summary(filename, summary):
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["phase", "count", "mean", "median", "max"])
+        for label, (count, mean, median, longest) in sorted(summary.items()):
+            writer.writerow([label, count, mean, median, longest])
+
+
+def load_phase_summary(filename):
+    with open(filename, newline="") as file:
+        return {row["phase"]: float(row["mean"]) for row in csv.DictReader(file)}
+
+
+def print_phase_summary(summary, baseline=None):
+    print(f"{'phase':<14}{'count':>7}{'mean ms':>11}{'median ms':>11}{'max ms':>10}", end="")
+    print(f"{'baseline ms':>13}{'change':>9}" if baseline else "")
+    for label, (count, mean, median, longest) in sorted(summary.items()):
+        print(f"{label:<14}{count:>7}{mean * 1000:>11.3f}{median * 1000:>11.3f}{longest * 1000:>10.3f}", end="")
+        if baseline and label in baseline:
+            before = baseline[label]
+            change = (mean - before) / before * 100 if before else 0.0
+            print(f"{before * 1000:>13.3f}{change:>8.1f}%")
+        else:
+            print()
+
+
+# Replay a journal and return (mismatches, phase summary)
+def replay(journal_file, fast=False, output_file=None):
+    header, recorded_trials = journal.read_journal(journal_file)
+    experiment = load_experiment(header["experiment"])
+    import pygame
+    import timing
+
+    if experiment.screen is None:
+        experiment.init_display()
+    for name, value in header["settings"].items():
+        setattr(experiment, name, value)
+    # Trials are late exactly where they were in the session (the journal
+    # records why), and the recorded schedule already holds their repeats
+    experiment.requeue_late_trials = False
+
+    if output_file is None:
+        output_file = journal_file.replace("_journal.jsonl", "") + "_replay_results.csv"
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    replayer = Replayer(pygame, timing, recorded_trials, experiment.RESPONSE_WINDOW, fast)
+    replay_journal = io.StringIO()
+    schedule = [entry["trial"] for entry in recorded_trials]
+
+    if fast:
+        timing.use_virtual_clock()
+    timing.add_flip_listener(replayer.on_flip)
+    timing.add_poll_hook(replayer.on_poll)
+    timing.set_phase_check(replayer.check_phases)
+    try:
+        if header["experiment"] == "exp_1":
+            experiment.run_experiment(schedule, output_file, replay_journal)
+        else:
+            experiment.run_experiment(schedule, {}, {}, output_file, replay_journal)
+        replayer.finish()
+    finally:
+        timing.remove_poll_hook(replayer.on_poll)
+        timing.set_phase_check(None)
+        timing.remove_flip_listener(replayer.on_flip)
+        timing.use_real_clock()
+
+    replayed_trials = [json.loads(line) for line in replay_journal.getvalue().splitlines()]
+    rt_tolerance = RT_TOLERANCE_FAST if fast else RT_TOLERANCE_REALTIME
+    mismatches = compare_trials(recorded_trials, replayed_trials, rt_tolerance)
+    return mismatches, summarize_phases(replayer.phase_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded exp_1 / exp_2 session.")
+    parser.add_argument("journal", help="Trial journal written by exp_1.py or exp_2.py")
+    parser.add_argument("--fast", action="store_true", help="Replay as fast as possible instead of in real time")
+    parser.add_argument("--output", help="Results CSV for the replayed session")
+    parser.add_argument("--timings", help="Save the per-phase timing summary to this CSV")
+    parser.add_argument("--baseline", help="Per-phase timing CSV from an earlier replay to compare against")
+    args = parser.parse_args()
+
+    mismatches, summary = replay(args.journal, fast=args.fast, output_file=args.output)
+
+    baseline = load_phase_summary(args.baseline) if args.baseline else None
+    print_phase_summary(summary, baseline)
+    if args.timings:
+        save_phase_summary(args.timings, summary)
+
+    if mismatches:
+        print(f"Replay differs from the recording in {len(mismatches)} place(s):")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+        raise SystemExit(1)
+    print("Replay matches the recorded session.")
+
+
+if __name__ == "__main__":
+    main()
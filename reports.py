@@ -0,0 +1,210 @@
+import argparse
+import glob
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import data_quality
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Folder holding the results CSV files and the folder the reports go to
+RESULTS_FOLDER = "."
+REPORTS_FOLDER = "reports"
+
+# Bump when the figures or tables change, so every report is rebuilt
+REPORT_VERSION = 1
+
+# Histogram bins for the reaction time distributions (seconds)
+RT_BINS = 30
+
+# ===============================
+# Report Code
+# ===============================
+# One report per participant (all results files named <participant>_exp1_...
+# and <participant>_exp2_...), written to reports/<participant>/:
+#   exp1.png / exp2.png   RT distribution by condition, accuracy by condition
+#                         and mean RT per session_number
+#   summary.csv           trials, accuracy, mean/median/SD RT and QA-flagged
+#                         trials (see data_quality.py) per experiment and condition
+#   index.html            the table and the figures
+# Participants are rendered in a process pool. inputs.json records the size
+# and modification time of the files a report was built from, and a report
+# whose inputs have not changed is skipped. reports/index.html links to all
+# participants.
+#
+# Usage:
+#   python reports.py
+#   python reports.py --results data/ --workers 8 --force
+
+SUMMARY_FIELDS = ["experiment", "condition", "trials", "accuracy", "mean_rt", "median_rt", "sd_rt", "flagged"]
+
+
+# {participant: {experiment: results file}} for every results file in folder
+def find_participants(folder):
+    participants = {}
+    for experiment, suffix in data_quality.SUFFIXES.items():
+        for filename in sorted(glob.glob(os.path.join(folder, f"*{suffix}"))):
+            participant = os.path.basename(filename)[:-len(suffix)]
+            participants.setdefault(participant, {})[experiment] = filename
+    return participants
+
+
+# Fingerprint of a participant's input files (and the report code version)
+def input_fingerprint(files):
+    inputs = {"version": REPORT_VERSION}
+    for experiment, filename in sorted(files.items()):
+        stat = os.stat(filename)
+        inputs[experiment] = [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+# Per-condition summary rows (plus an "all" row) for one experiment
+def summarize(experiment, results, trials, flags):
+    rows = []
+    by_condition = results[data_quality.CONDITION_COLUMNS[experiment]]
+    for condition in ["all"] + sorted(by_condition.unique()):
+        mask = by_condition == condition if condition != "all" else by_condition.notna()
+        rt = trials.loc[mask, "rt"].dropna()
+        rows.append({
+            "experiment": experiment,
+            "condition": condition,
+            "trials": int(mask.sum()),
+            "accuracy": trials.loc[mask, "correct"].mean(),
+            "mean_rt": rt.mean(),
+            "median_rt": rt.median(),
+            "sd_rt": rt.std(),
+            "flagged": int(flags.loc[mask, "flagged"].sum()),
+        })
+    return rows
+
+
+def plot_experiment(filename, experiment, results, trials):
+    conditions = results[data_quality.CONDITION_COLUMNS[experiment]]
+    fig, (rt_ax, accuracy_ax, session_ax) = plt.subplots(1, 3, figsize=(15, 4))
+
+    bins = np.histogram_bin_edges(trials["rt"].dropna(), bins=RT_BINS)   # Same bins for every condition
+    for condition in sorted(conditions.unique()):
+        rt_ax.hist(trials.loc[conditions == condition, "rt"].dropna(), bins=bins, alpha=0.5, label=condition)
+    rt_ax.set_xlabel("Reaction time (s)")
+    rt_ax.set_ylabel("Trials")
+    rt_ax.set_title("RT distribution")
+    rt_ax.legend()
+
+    accuracy = trials["correct"].groupby(conditions).mean()
+    accuracy_ax.bar(accuracy.index, accuracy.values, color="grey")
+    accuracy_ax.set_ylim(0, 1)
+    accuracy_ax.set_ylabel("Accuracy")
+    accuracy_ax.set_title("Accuracy by condition")
+
+    sessions = pd.to_numeric(results["session_number"])
+    session_rt = trials["rt"].groupby(sessions).mean()
+    session_ax.plot(session_rt.index, session_rt.values, marker="o")
+    session_ax.set_xlabel("session_number")
+    session_ax.set_ylabel("Mean RT (s)")
+    session_ax.set_title("RT across sessions")
+
+    fig.suptitle(experiment)
+    # Fixed margins instead of tight_layout(), which measures every label and
+    # costs about as much as drawing the figure
+    fig.subplots_adjust(left=0.05, right=0.98, bottom=0.13, top=0.85, wspace=0.25)
+    fig.savefig(filename, pil_kwargs={"compress_level": 1})
+    plt.close(fig)
+
+
+def write_page(filename, participant, summary, figures):
+    table = summary.to_html(index=False, float_format=lambda value: f"{value:.3f}")
+    images = "".join(f'<p><img src="{figure}" alt="{figure}"></p>\n' for figure in figures)
+    with open(filename, "w") as file:
+        file.write(f"<html><head><title>{html.escape(participant)}</title></head><body>\n"
+                   f"<h1>{html.escape(participant)}</h1>\n{table}\n{images}</body></html>\n")
+
+
+# Build one participant's report (runs in a worker process)
+def render_participant(job):
+    participant, files, output_dir, fingerprint = job
+    os.makedirs(output_dir, exist_ok=True)
+    rows = []
+    figures = []
+    for experiment, filename in sorted(files.items()):
+        results = data_quality.read_results_file(filename, experiment)
+        if results.empty:
+            continue
+        trials = data_quality.normalize(results, experiment)
+        flags = data_quality.add_flags(results, experiment)
+        rows.extend(summarize(experiment, results, trials, flags))
+        figure = f"{experiment.replace('_', '')}.png"
+        plot_experiment(os.path.join(output_dir, figure), experiment, results, trials)
+        figures.append(figure)
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_FIELDS)
+    summary.to_csv(os.path.join(output_dir, "summary.csv"), index=False)
+    write_page(os.path.join(output_dir, "index.html"), participant, summary, figures)
+    with open(os.path.join(output_dir, "inputs.json"), "w") as file:
+        json.dump({"fingerprint": fingerprint}, file)
+    return participant
+
+
+def is_up_to_date(output_dir, fingerprint):
+    try:
+        with open(os.path.join(output_dir, "inputs.json")) as file:
+            return json.load(file)["fingerprint"] == fingerprint
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def write_index(reports_folder, participants):
+    rows = []
+    for participant in sorted(participants):
+        summary = pd.read_csv(os.path.join(reports_folder, participant, "summary.csv"))
+        overall = summary[summary["condition"] == "all"]
+        link = f'<a href="{html.escape(participant)}/index.html">{html.escape(participant)}</a>'
+        for _, row in overall.iterrows():
+            rows.append({"participant": link, **row.drop("condition").to_dict()})
+    table = pd.DataFrame(rows).to_html(index=False, escape=False, float_format=lambda value: f"{value:.3f}")
+    with open(os.path.join(reports_folder, "index.html"), "w") as file:
+        file.write(f"<html><head><title>Participant reports</title></head><body>\n"
+                   f"<h1>Participant reports ({len(participants)})</h1>\n{table}\n</body></html>\n")
+
+
+def build_reports(results_folder=RESULTS_FOLDER, reports_folder=REPORTS_FOLDER, workers=None, force=False):
+    participants = find_participants(results_folder)
+    jobs = []
+    for participant, files in participants.items():
+        output_dir = os.path.join(reports_folder, participant)
+        fingerprint = input_fingerprint(files)
+        if force or not is_up_to_date(output_dir, fingerprint):
+            jobs.append((participant, files, output_dir, fingerprint))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for participant in pool.map(render_participant, jobs):
+                print(f"Report written for {participant}")
+    if participants:
+        write_index(reports_folder, participants)
+    print(f"{len(jobs)} reports built, {len(participants) - len(jobs)} unchanged; "
+          f"index at {os.path.join(reports_folder, 'index.html')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a figure set and summary table for every participant.")
+    parser.add_argument("--results", default=RESULTS_FOLDER, help="Folder with the results CSV files")
+    parser.add_argument("--output", default=REPORTS_FOLDER, help="Folder the reports are written to")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--force", action="store_true", help="Rebuild every report")
+    args = parser.parse_args()
+    build_reports(args.results, args.output, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import math
+
+# ===============================
+# Running Statistics
+# ===============================
+
+
+# Mean and variance of a stream of values, updated in constant time per value
+# (Welford's algorithm)
+class RunningStats:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def sd(self):
+        return math.sqrt(self.variance)
+
+
+# Value at the given fraction (0-1) of a list, nearest rank
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
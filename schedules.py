@@ -0,0 +1,32 @@
+import random
+
+# ===============================
+# Trial Schedules
+# ===============================
+# Trial-order logic shared by the experiments and by tools that must not
+# import pygame (e.g. power_analysis.py). Pass a random.Random instance as rng
+# for reproducible schedules.
+
+
+# exp_2 / exp_2_try: independent random shape and distractor type on every trial
+def generate_trials(shapes, distractor_types, total_trials, rng=random):
+    trials = []
+    for _ in range(total_trials):
+        shape = rng.choice(shapes)
+        distractor_type = rng.choice(distractor_types)
+        trials.append({"shape": shape, "distractor_type": distractor_type})
+    rng.shuffle(trials)
+    return trials
+
+
+# exp_1 / exp_1_try: shuffle the stimulus pool and keep the first total_trials
+def sample_stimuli(stimuli, total_trials, rng=random):
+    stimuli = list(stimuli)
+    rng.shuffle(stimuli)
+    return stimuli[:total_trials]
+
+
+# Repeat a trial at a random later point of the schedule (after index), so a
+# trial thrown out during the session is run again with the same condition
+def requeue(schedule, index, trial, rng=random):
+    schedule.insert(rng.randint(index + 1, len(schedule)), trial)
@@ -0,0 +1,141 @@
+import argparse
+import time
+
+import pygame
+
+import exp_1
+import exp_1_try
+import exp_2
+import exp_2_try
+import image_cache
+import render_backend
+import timing
+
+# ===============================
+# Customizable Variables
+# ===============================
+
+# Window settings
+WINDOW_WIDTH = 1200
+WINDOW_HEIGHT = 800
+RENDER_BACKEND = "surface"    # "surface" or "texture" (SDL2 renderer, see render_backend.py)
+
+# Blocks run for every participant, in order
+BLOCKS = ["exp_1_try", "exp_1", "exp_2_try", "exp_2"]
+
+# Decode every face before the first participant instead of during their trials
+PRELOAD_FACES = True
+
+SESSION_DONE_TEXT = "Session complete! Press SPACE for the next participant."
+
+# ===============================
+# Session Host Code
+# ===============================
+# Keeps one window, one font and the stimulus indexes and decoded images in
+# memory, and runs the practice and main blocks of both experiments for one
+# participant after another. Each block is the experiment module's own
+# run_session(), drawing into the shared window.
+#
+# Usage:
+#   python session_host.py
+#   python session_host.py --blocks exp_1 exp_2
+
+EXPERIMENTS = {"exp_1_try": exp_1_try, "exp_1": exp_1, "exp_2_try": exp_2_try, "exp_2": exp_2}
+
+# Blocks that record data take the participant's name and number
+RECORDING_BLOCKS = {"exp_1", "exp_2"}
+
+screen = None
+font = None
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+
+# Open the shared window and hand it to every experiment module
+def init_display():
+    global screen, font
+    pygame.display.init()
+    pygame.font.init()
+    screen = render_backend.open_window(
+        (WINDOW_WIDTH, WINDOW_HEIGHT), "Emotion Categorization Session", RENDER_BACKEND
+    )
+    font = render_backend.CachedFont(None, 50)
+    for experiment in EXPERIMENTS.values():
+        experiment.screen = screen
+        experiment.font = font
+
+
+# Index and decode the stimuli once for the whole session
+def warm_up(blocks):
+    start = time.perf_counter()
+    if "exp_1" in blocks:
+        faces = exp_1.load_faces()
+        if PRELOAD_FACES:
+            # Decoded once, and uploaded to the GPU once with the texture backend
+            render_backend.upload(screen, image_cache.preload(faces.paths, (400, 400)))
+    if "exp_1_try" in blocks:
+        exp_1_try.load_faces()
+    if "exp_2" in blocks:
+        exp_2.load_distractors()
+        exp_2.load_shapes()
+    if "exp_2_try" in blocks:
+        exp_2_try.load_distractors()
+        exp_2_try.load_shapes()
+    print(f"Stimuli ready in {time.perf_counter() - start:.2f} s")
+
+
+# Print how long the screen stayed unchanged between two blocks
+def report_changeover(name, block_end):
+    def on_first_flip(label, flip_time):
+        timing.remove_flip_listener(on_first_flip)
+        print(f"{name}: first screen {(time.perf_counter() - block_end) * 1000:.1f} ms after the previous block")
+    timing.add_flip_listener(on_first_flip)
+
+
+# Run every block for one participant
+def run_participant(participant_name, participant_number, blocks):
+    block_end = time.perf_counter()
+    for name in blocks:
+        report_changeover(name, block_end)
+        if name in RECORDING_BLOCKS:
+            EXPERIMENTS[name].run_session(participant_name, participant_number)
+        else:
+            EXPERIMENTS[name].run_session()
+        block_end = time.perf_counter()
+
+
+def display_session_done():
+    screen.fill(WHITE)
+    text_surface = font.render(SESSION_DONE_TEXT, True, BLACK)
+    text_rect = text_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+    screen.blit(text_surface, text_rect)
+    timing.flip("end")
+    return timing.wait_for_key(pygame.K_SPACE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run practice and main blocks for participant after participant.")
+    parser.add_argument("--blocks", nargs="+", choices=BLOCKS, default=BLOCKS, help="Blocks to run, in order")
+    args = parser.parse_args()
+
+    init_display()
+    for block in [block for block in args.blocks if block in RECORDING_BLOCKS]:
+        if not EXPERIMENTS[block].run_preflight():
+            pygame.quit()
+            return
+    warm_up(args.blocks)
+
+    while True:
+        participant_name, participant_number = exp_1.get_participant_info()
+        if not participant_name or not participant_number:
+            break
+        run_participant(participant_name, participant_number, args.blocks)
+        if not display_session_done():
+            break
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import time
+
+import pygame
+
+# ===============================
+# Trial Timing
+# ===============================
+# The experiments read the clock, wait, flip the display and poll for events
+# through these functions so that a session can be driven by something other
+# than a live participant (e.g. replay.py). By default they are thin wrappers
+# around time.perf_counter(), pygame.time.delay(), pygame.display.flip() and
+# pygame.event.get(); render_backend.py swaps the flip for a renderer present
+# when the texture backend is in use.
+
+WAIT_TIMEOUT_MS = 100        # Longest a waiting screen sleeps before polling again
+
+_virtual_now = None          # Current virtual time, or None for the real clock
+_flip_listeners = []         # Called as listener(label, flip_time) after every flip
+_poll_hooks = []             # Called before every event poll
+_present = pygame.display.flip   # Shows the finished frame (see render_backend.py)
+_frame_duration = 0.0        # Refresh interval when _present waits for vsync, else 0
+_phase_check = None          # Replaces the measurement in check_phases() (see replay.py)
+
+
+# Current time in seconds
+def now():
+    if _virtual_now is not None:
+        return _virtual_now
+    return time.perf_counter()
+
+
+# Wait for the given number of seconds
+def delay(seconds):
+    if _virtual_now is not None:
+        advance(seconds)
+    else:
+        pygame.time.delay(int(seconds * 1000))
+
+
+# Time from a phase's onset flip until its closing flip must be started for
+# the phase to last the given number of seconds. A vsync'd present waits for
+# the next refresh itself, so this is half a frame before the refresh closest
+# to that time (waiting the full time would make every such flip a frame late).
+def phase_budget(seconds):
+    frame = frame_duration()
+    if frame > 0:
+        return max(round(seconds / frame), 1) * frame - frame / 2
+    return seconds
+
+
+# Wait so that the next flip lands the given number of seconds after the
+# flip at onset (by default, now). Work done since onset, such as loading the
+# next images, is taken off the wait.
+def delay_before_flip(seconds, onset=None):
+    elapsed = 0.0 if onset is None else now() - onset
+    delay(phase_budget(seconds) - elapsed)
+
+
+# Flip the display and return the time at which the flip completed
+def flip(label=None):
+    _present()
+    flip_time = now()
+    for listener in _flip_listeners:
+        listener(label, flip_time)
+    return flip_time
+
+
+# Check the measured durations of consecutive display phases against their
+# configured ones. phases holds (label, onset flip time, duration) in order
+# and end is the onset of the flip that ends the last phase. With vsync'd
+# flips a phase can only last a whole number of frames, so it is compared
+# with its duration rounded to the frame grid, and anything over half a
+# frame off (a missed refresh) counts; tolerance is used when flips are not
+# vsync'd. Returns a description of the first phase that is off (e.g. the
+# stimulus flip missed its refresh), or None if every phase kept time.
+def check_phases(phases, end, tolerance):
+    if _phase_check is not None:
+        return _phase_check(phases, end, tolerance)
+    frame = frame_duration()
+    if frame > 0:
+        tolerance = frame / 2
+    ends = [onset for _, onset, _ in phases[1:]] + [end]
+    for (label, onset, duration), phase_end in zip(phases, ends):
+        if frame > 0:
+            duration = max(round(duration / frame), 1) * frame
+        error = phase_end - onset - duration
+        if abs(error) > tolerance:
+            return f"{label} {error * 1000:+.1f} ms"
+    return None
+
+
+# Poll for pending events
+def get_events():
+    for hook in _poll_hooks:
+        hook()
+    return pygame.event.get()
+
+
+# Sleep until an event arrives (or the timeout passes) and return all pending
+# events. Used by screens that wait for the participant, so they do not spin
+# a CPU core while nothing happens.
+def wait_events(timeout_ms=WAIT_TIMEOUT_MS):
+    for hook in _poll_hooks:
+        hook()
+    event = pygame.event.wait(timeout_ms)
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
+
+
+# Wait until the given key is pressed. Returns False if the window was closed.
+def wait_for_key(key):
+    while True:
+        for event in wait_events():
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == pygame.KEYDOWN and event.key == key:
+                return True
+
+
+# Switch to a virtual clock that only moves when advanced
+def use_virtual_clock(start=0.0):
+    global _virtual_now
+    _virtual_now = start
+
+
+# Switch back to the real clock
+def use_real_clock():
+    global _virtual_now
+    _virtual_now = None
+
+
+# Move the virtual clock forward
+def advance(seconds):
+    global _virtual_now
+    if _virtual_now is None:
+        raise RuntimeError("advance() requires the virtual clock")
+    _virtual_now += max(seconds, 0.0)
+
+
+# Replace the function flip() uses to show a frame. frame_duration is the
+# refresh interval if present waits for vsync, 0 if it returns right away.
+def set_present(present, frame_duration=0.0):
+    global _present, _frame_duration
+    _present = present
+    _frame_duration = frame_duration
+
+
+# Let check_phases() return check(phases, end, tolerance) instead of its own
+# result (None restores the measurement)
+def set_phase_check(check):
+    global _phase_check
+    _phase_check = check
+
+
+# Refresh interval flips are locked to, or 0 when they are not vsync'd (the
+# virtual clock has no refresh)
+def frame_duration():
+    return _frame_duration if _virtual_now is None else 0.0
+
+
+# first=True puts the listener ahead of the others (e.g. for event markers)
+def add_flip_listener(listener, first=False):
+    if first:
+        _flip_listeners.insert(0, listener)
+    else:
+        _flip_listeners.append(listener)
+
+
+def remove_flip_listener(listener):
+    _flip_listeners.remove(listener)
+
+
+def add_poll_hook(hook):
+    _poll_hooks.append(hook)
+
+
+def remove_poll_hook(hook):
+    _poll_hooks.remove(hook)